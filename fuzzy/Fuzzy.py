@@ -1,8 +1,316 @@
+import copy
+import functools
+import logging
+import math
+import os
+import threading
+import time
+import weakref
 import numpy as np
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
-import matplotlib.pyplot as plt
+from instrumentacao import Instrumentacao
+from motor import TAMANHO_BLOCO, CacheLRU, Cenarios, Encadeamento, TabelaConsulta, carregar_modelo, construir_skfuzzy
+
+# Pertinências e regras dos quatro sistemas: modelo.json (ou o arquivo indicado em FUZZY_MODELO,
+# útil para os processos do reprocessar.py e do servico.py usarem uma variante); ver configurar_modelo
+CAMINHO_MODELO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modelo.json')
+_modelo = carregar_modelo(os.environ.get('FUZZY_MODELO') or CAMINHO_MODELO)
+# Sistemas do modelo em uso (cópia própria deste módulo: alterá-los não muda o arquivo; o
+# identificador de modelo_atual() acompanha as alterações, que valem depois de recarregar_sistemas)
+SISTEMAS = _modelo.sistemas
+
+# Construção sob demanda: importar este módulo não importa skfuzzy nem matplotlib.
+# O cálculo usa só os sistemas compilados; os objetos do skfuzzy servem de referência e para os gráficos
+_compilados = {}
+# Limites de normalização de cada sistema compilado, resolvidos uma vez por compilação (ver _limites)
+_limites_compilados = {}
+_sistemas_ctrl = {}
+_simuladores = {}
+_trava_construcao = threading.RLock()
+# Opções de compilação (ver configurar_motor)
+_opcoes_motor = {'defuzzificacao': 'amostrada', 'resolucao': None}
+# Caches LRU opcionais das funções escalares, por rótulo da saída (ver ativar_cache)
+_caches = {}
+# Tabela por estado do índice ambiental, calculada uma vez por sistema compilado: UFs em ordem,
+# regulamentação, escoamento e as pertinências do escoamento (constante no estado) nos termos do
+# sistema ambiental. A última linha (NaN) é usada para estados desconhecidos (ver _tabela_estados)
+_tabelas_estado = {}
+# Tabela da sustentabilidade no modo LUT (ver ativar_modo_lut); None = cálculo exato
+tabela_sustentabilidade = None
+
+# Erros das funções escalares vão para o logger 'fuzzy' (e para a instrumentação, se ativa)
+_registro = logging.getLogger('fuzzy')
+# Instrumentacao ativa (ver ativar_instrumentacao); None = nenhuma medida
+_instrumentacao = None
+
+# Simuladores do skfuzzy por thread. O skfuzzy guarda entradas e resultados nos próprios termos do
+# ControlSystem, então simuladores que compartilham o sistema se atropelam quando usados em paralelo
+_simuladores_thread = threading.local()
+_trava_copia = threading.Lock()
+# Incrementada por recarregar_sistemas: os simuladores por thread de gerações anteriores são descartados
+_geracao_sistemas = 0
+
+# SISTEMAS: COMPILAÇÃO SOB DEMANDA E OBJETOS DO SKFUZZY
+def _compilado(nome):
+    """
+    SistemaCompilado de 'social', 'economico', 'ambiental' ou 'sustentabilidade' (compilado no primeiro uso)
+    """
+    compilado = _compilados.get(nome)
+    if compilado is None:
+        with _trava_construcao:
+            if nome not in _compilados:
+                _compilados[nome] = _modelo.compilado(nome, **_opcoes_motor)
+            compilado = _compilados[nome]
+    return compilado
+
+def _limites(nome):
+    """
+    Menor e maior saída possível do sistema, usadas para levar o índice a 0-100.
+    Vêm do modelo.json; em outros modos do motor (ver configurar_motor) ou depois de alterar o sistema,
+    são calculadas no primeiro uso e guardadas só em memória (ver Modelo.limites). Resolvidas uma vez
+    por compilação, ao lado do sistema compilado, e descartadas com ele por recarregar_sistemas
+    """
+    limites = _limites_compilados.get(nome)
+    if limites is None:
+        with _trava_construcao:
+            if nome not in _limites_compilados:
+                _limites_compilados[nome] = _modelo.limites(nome, **_opcoes_motor)
+            limites = _limites_compilados[nome]
+    return limites
+
+def configurar_motor(defuzzificacao='amostrada', resolucao=None):
+    """
+    Escolhe como os sistemas são compilados e recompila todos:
+    defuzzificacao='amostrada' (padrão, igual ao skfuzzy) ou 'analitica' (pertinências e centroide
+    exatos dos termos, sem amostrar os universos, e mais rápido);
+    resolucao: no modo amostrado, número de pontos de cada universo no lugar do passo original
+    """
+    if defuzzificacao not in ('amostrada', 'analitica'):
+        raise ValueError(f"Defuzzificação desconhecida: {defuzzificacao}")
+    _opcoes_motor.update(defuzzificacao=defuzzificacao, resolucao=resolucao)
+    recarregar_sistemas()
+
+def configurar_modelo(caminho=None):
+    """
+    Passa a usar o modelo gravado em `caminho` (padrão: modelo.json) e recompila os sistemas.
+    Retorna o Modelo carregado
+    """
+    global _modelo, SISTEMAS
+    modelo = carregar_modelo(caminho or CAMINHO_MODELO)
+    with _trava_construcao:
+        _modelo, SISTEMAS = modelo, modelo.sistemas
+    recarregar_sistemas()
+    return modelo
+
+def modelo_atual():
+    """
+    Modelo em uso; modelo_atual().identificador ('versão+hash') identifica os índices que ele produz
+    """
+    return _modelo
+
+def _sistema_ctrl(nome):
+    """
+    ctrl.ControlSystem do skfuzzy do sistema (construído no primeiro uso)
+    """
+    sistema_ctrl = _sistemas_ctrl.get(nome)
+    if sistema_ctrl is None:
+        with _trava_construcao:
+            if nome not in _sistemas_ctrl:
+                _sistemas_ctrl[nome] = construir_skfuzzy(SISTEMAS[nome])
+            sistema_ctrl = _sistemas_ctrl[nome]
+    return sistema_ctrl
+
+def recarregar_sistemas():
+    """
+    Descarta os sistemas já construídos para que alterações em SISTEMAS (pertinências ou regras)
+    passem a valer. Os caches de resultados se esvaziam no próximo uso, pois a assinatura do sistema muda,
+    e modelo_atual().identificador passa a refletir o conteúdo alterado (os limites de normalização
+    gravados deixam de valer para o sistema alterado e são recalculados). Para guardar a alteração:
+    modelo_atual().salvar(caminho)
+    """
+    global _geracao_sistemas
+    with _trava_construcao:
+        _compilados.clear()
+        _limites_compilados.clear()
+        _sistemas_ctrl.clear()
+        _simuladores.clear()
+        _tabelas_estado.clear()
+        _geracao_sistemas += 1
+    if tabela_sustentabilidade is not None:
+        ativar_modo_lut(tabela_sustentabilidade.resolucao, tabela_sustentabilidade.diretorio)
+
+def _simulacao(sistema_ctrl):
+    from skfuzzy import control as ctrl
+    return ctrl.ControlSystemSimulation(sistema_ctrl)
+
+def _simulador(nome):
+    """
+    Simulador compartilhado do skfuzzy (referência); em código concorrente use simulador_da_thread
+    """
+    with _trava_construcao:
+        if nome not in _simuladores:
+            _simuladores[nome] = _simulacao(_sistema_ctrl(nome))
+        return _simuladores[nome]
+
+def simulador_da_thread(sistema_ctrl):
+    """
+    ControlSystemSimulation exclusivo da thread atual, sobre uma cópia independente de sistema_ctrl.
+    A cópia é criada no primeiro uso em cada thread e reaproveitada depois; ela é descartada quando
+    sistema_ctrl deixa de existir ou quando recarregar_sistemas é chamada
+    """
+    if getattr(_simuladores_thread, 'geracao', None) != _geracao_sistemas:
+        _simuladores_thread.simuladores = weakref.WeakKeyDictionary()
+        _simuladores_thread.geracao = _geracao_sistemas
+    simuladores = _simuladores_thread.simuladores
+    simulador = simuladores.get(sistema_ctrl)
+    if simulador is None:
+        with _trava_copia:
+            copia = copy.deepcopy(sistema_ctrl)
+        simulador = simuladores[sistema_ctrl] = _simulacao(copia)
+    return simulador
+
+def _sistema_modelo(nome):
+    return SISTEMAS[nome]
+
+# Nomes globais de versões anteriores do módulo, resolvidos sob demanda por __getattr__
+_NOMES_SOB_DEMANDA = {
+    'SISTEMA_SOCIAL': (_sistema_modelo, 'social'),
+    'SISTEMA_ECONOMICO': (_sistema_modelo, 'economico'),
+    'SISTEMA_AMBIENTAL': (_sistema_modelo, 'ambiental'),
+    'SISTEMA_SUSTENTABILIDADE': (_sistema_modelo, 'sustentabilidade'),
+    'sistema_social': (_sistema_ctrl, 'social'),
+    'sistema_economico': (_sistema_ctrl, 'economico'),
+    'sistema_ambiental': (_sistema_ctrl, 'ambiental'),
+    'sistema_controle': (_sistema_ctrl, 'sustentabilidade'),
+    'simulador_social': (_simulador, 'social'),
+    'simulador_economico': (_simulador, 'economico'),
+    'simulador_ambiental': (_simulador, 'ambiental'),
+    'sistema': (_simulador, 'sustentabilidade'),
+    'compilado_social': (_compilado, 'social'),
+    'compilado_economico': (_compilado, 'economico'),
+    'compilado_ambiental': (_compilado, 'ambiental'),
+    'compilado_sustentabilidade': (_compilado, 'sustentabilidade'),
+    'NORMALIZACAO_SOCIAL': (_limites, 'social'),
+    'NORMALIZACAO_ECONOMICA': (_limites, 'economico'),
+    'NORMALIZACAO_AMBIENTAL': (_limites, 'ambiental'),
+    'NORMALIZACAO_SUSTENTABILIDADE': (_limites, 'sustentabilidade'),
+}
+
+def __getattr__(nome):
+    if nome in _NOMES_SOB_DEMANDA:
+        construtor, sistema_nome = _NOMES_SOB_DEMANDA[nome]
+        return construtor(sistema_nome)
+    # Variáveis fuzzy do skfuzzy pelo rótulo (Anos_de_estudo, FV, indice_social, sustentabilidade, ...)
+    for sistema_nome, modelo in SISTEMAS.items():
+        if nome in modelo['antecedentes'] or nome == modelo['consequente'][0]:
+            return next(v for v in _sistema_ctrl(sistema_nome).fuzzy_variables if v.label == nome)
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+# ERROS E INSTRUMENTAÇÃO DAS FUNÇÕES ESCALARES
+def _reportar_erro(indice, erro, entradas):
+    evento = {'tipo': 'erro', 'indice': indice, 'erro': type(erro).__name__, 'mensagem': str(erro),
+              'entradas': entradas}
+    _registro.warning("Erro no cálculo do índice %s: %s", indice, erro, extra={'evento': evento})
+    if _instrumentacao is not None:
+        _instrumentacao.registrar_erro(evento)
+
+def _funcao_de_calculo(indice):
+    """
+    Decorador das funções escalares: um erro vira evento (logger 'fuzzy' e instrumentação) e a
+    função retorna None. Com a instrumentação ativa, cada chamada é medida
+    """
+    def decorar(funcao):
+        parametros = funcao.__code__.co_varnames[:funcao.__code__.co_argcount]
+
+        @functools.wraps(funcao)
+        def calcular(*args, **kwargs):
+            instrumentacao = _instrumentacao
+            if instrumentacao is not None:
+                inicio = time.perf_counter()
+            try:
+                resultado = funcao(*args, **kwargs)
+            except Exception as e:
+                _reportar_erro(indice, e, {**dict(zip(parametros, args)), **kwargs})
+                resultado = None
+            if instrumentacao is not None:
+                instrumentacao.registrar_chamada(indice, time.perf_counter() - inicio, resultado is None)
+            return resultado
+        return calcular
+    return decorar
+
+def ativar_instrumentacao(callback=None, etapas=True):
+    """
+    Passa a medir as funções escalares calcular_*: chamadas, erros, histograma de latência e,
+    com etapas=True, o tempo de entradas, fuzzificação, regras e defuzzificação de cada índice.
+    callback(evento) recebe um dict por chamada e por erro. Retorna a Instrumentacao
+    (resumo(), texto_prometheus())
+    """
+    global _instrumentacao
+    _instrumentacao = Instrumentacao(callback, etapas)
+    return _instrumentacao
+
+def desativar_instrumentacao():
+    global _instrumentacao
+    _instrumentacao = None
+
+def metricas_prometheus():
+    """
+    Métricas da instrumentação ativa no formato texto do Prometheus ('' se desativada)
+    """
+    return '' if _instrumentacao is None else _instrumentacao.texto_prometheus()
+
+# AUXILIARES DO CÁLCULO
+class EntradaInvalida(ValueError):
+    """
+    Entrada ausente (None) ou não numérica, NaN ou infinita numa função escalar
+    """
+
+def _entradas_lote(valores, rotulos):
+    """
+    Monta o dicionário rótulo -> array para as funções em lote.
+    Aceita os arrays na ordem dos argumentos ou um DataFrame/dict com colunas nomeadas pelos rótulos
+    """
+    if len(valores) == 1 and hasattr(valores[0], 'keys'):
+        dados = valores[0]
+        return {rotulo: np.asarray(dados[rotulo], dtype=float) for rotulo in rotulos}
+    if len(valores) != len(rotulos):
+        raise TypeError(f"Esperados {len(rotulos)} arrays ou um DataFrame, recebidos {len(valores)} argumentos")
+    return {rotulo: np.asarray(v, dtype=float) for rotulo, v in zip(rotulos, valores)}
+
+def _normalizar(valor, limites):
+    minimo, maximo = limites
+    return (valor - minimo)*100/(maximo - minimo)
+
+def _conferir_entradas(entradas):
+    """
+    Levanta EntradaInvalida, com o nome da variável, para entrada ausente, não numérica ou não finita
+    (que o motor transformaria em NaN e relataria como nenhuma regra ativada)
+    """
+    for rotulo, valor in entradas.items():
+        try:
+            finito = valor is not None and math.isfinite(float(valor))
+        except (TypeError, ValueError):
+            finito = False
+        if not finito:
+            raise EntradaInvalida(f"'{rotulo}' ausente, não numérico ou não finito: {valor!r}")
+
+def _avaliar_escalar(compilado, entradas):
+    """
+    Avalia uma única fazenda no sistema compilado, levantando EntradaInvalida para entradas ausentes ou
+    não finitas e ValueError quando não há saída. Passa pelo cache do sistema quando ativar_cache foi chamado
+    """
+    _conferir_entradas(entradas)
+    def calcular(valores):
+        cronometro = None if _instrumentacao is None else _instrumentacao.cronometro()
+        resultado = compilado.avaliar(valores, cronometro=cronometro)[0]
+        if np.isnan(resultado):
+            raise ValueError(f"não foi possível defuzzificar '{compilado.saida}' (nenhuma regra ativada)")
+        return float(resultado)
+
+    cache = _caches.get(compilado.saida)
+    return calcular(entradas) if cache is None else cache.consultar(compilado, entradas, calcular)
+
 def configurar_plots():
+    import matplotlib.pyplot as plt
     plt.rcParams['figure.figsize'] = [10, 6]
     plt.rcParams['font.size'] = 12
 
@@ -18,184 +326,54 @@ def configurar_plots():
 #TC = P1 + 2*P2 + 3*P3 numero de cursos operacionais+2*num de cursos tecnicos+3*número de cursos especializantes
 #JQ= (Número de funcionários permanentes/Número de funcionários temporários+1)/(Número de funcionários temporários+1)
 
-Anos_de_estudo= ctrl.Antecedent(np.arange(0,21,1),'Anos_de_estudo')
-plano_saude = ctrl.Antecedent(np.arange(0, 1.1, 0.1), 'plano_saude')
-compartilha_lucros = ctrl.Antecedent(np.arange(0, 1.1, 0.1), 'compartilha_lucros')
-JA = ctrl.Antecedent(np.arange(0, 1.1, 0.1), 'JA')
-TC = ctrl.Antecedent(np.arange(0, 21, 1), 'TC')
-JQ = ctrl.Antecedent(np.arange(0, 21, 1), 'JQ')
-indice_social = ctrl.Consequent(np.arange(0, 101, 1), 'indice_social')
-
-Anos_de_estudo['muito_baixo'] = fuzz.trimf(Anos_de_estudo.universe, [0, 0, 5])
-Anos_de_estudo['baixo'] = fuzz.trimf(Anos_de_estudo.universe, [3, 5, 8])
-Anos_de_estudo['medio'] = fuzz.trimf(Anos_de_estudo.universe, [6, 9, 13])
-Anos_de_estudo['alto'] = fuzz.trimf(Anos_de_estudo.universe, [10, 13, 16])
-Anos_de_estudo['Muito alto'] = fuzz.trapmf(Anos_de_estudo.universe, [13, 16, 20, 20])
-
-plano_saude['nao']= fuzz.trimf(plano_saude.universe, [0, 0, 0.5])
-plano_saude['sim']= fuzz.trimf(plano_saude.universe, [0.5, 1, 1])
-
-compartilha_lucros['nao']= fuzz.trimf(compartilha_lucros.universe, [0, 0, 0.5])
-compartilha_lucros['sim']= fuzz.trimf(compartilha_lucros.universe, [0.5, 1, 1])
-
-JA['muito_baixo']= fuzz.trimf(JA.universe, [0, 0, 0.2])
-JA['baixo']= fuzz.trimf(JA.universe, [0.1, 0.25, 0.4])
-JA['medio']= fuzz.trimf(JA.universe, [0.3, 0.45, 0.6])
-JA['alto']= fuzz.trimf(JA.universe, [0.5, 0.65, 0.8])
-JA['Muito alto']= fuzz.trapmf(JA.universe, [0.7, 0.85, 1, 1])
-
-
-TC['muito_baixo']= fuzz.trimf(TC.universe, [0, 0, 4])
-TC['baixo']= fuzz.trimf(TC.universe, [2, 5, 8])
-TC['medio']= fuzz.trimf(TC.universe, [8, 10, 12])
-TC['alto']= fuzz.trimf(TC.universe, [10, 12, 14])
-TC['Muito alto']= fuzz.trapmf(TC.universe, [12, 16, 20, 20])
-
-JQ['muito_baixo']= fuzz.trimf(JQ.universe, [0, 0, 4])
-JQ['baixo']= fuzz.trimf(JQ.universe, [2, 5, 8])
-JQ['medio']= fuzz.trimf(JQ.universe, [8, 10, 12])
-JQ['alto']= fuzz.trimf(JQ.universe, [10, 12, 14])
-JQ['Muito alto']= fuzz.trapmf(JQ.universe, [12, 16, 20, 20])
-
-indice_social['muito_baixo'] = fuzz.trimf(indice_social.universe, [0, 0, 25])
-indice_social['baixo'] = fuzz.trimf(indice_social.universe, [0, 25, 50])
-indice_social['medio'] = fuzz.trimf(indice_social.universe, [25, 50, 75])
-indice_social['alto'] = fuzz.trapmf(indice_social.universe, [50, 75, 100, 100])
-
-#Regras
-regras_social = []
-regras_social.append(ctrl.Rule(JA['Muito alto'], indice_social['muito_baixo']))
-regras_social.append(ctrl.Rule(JA['alto'], indice_social['baixo']))
-regras_social.append(ctrl.Rule(JA['medio'], indice_social['medio']))
-regras_social.append(ctrl.Rule(JA['baixo'], indice_social['alto']))
-regras_social.append(ctrl.Rule(JA['muito_baixo'], indice_social['alto']))
-regras_social.append(ctrl.Rule(Anos_de_estudo['alto'], indice_social['alto']))
-regras_social.append(ctrl.Rule(Anos_de_estudo['medio'], indice_social['medio']))
-regras_social.append(ctrl.Rule(Anos_de_estudo['baixo'], indice_social['baixo']))
-regras_social.append(ctrl.Rule(Anos_de_estudo['muito_baixo'], indice_social['muito_baixo']))
-regras_social.append(ctrl.Rule(Anos_de_estudo['Muito alto'], indice_social['alto']))
-regras_social.append(ctrl.Rule(compartilha_lucros['sim'], indice_social['alto']))
-regras_social.append(ctrl.Rule(compartilha_lucros['nao'], indice_social['baixo']))
-regras_social.append(ctrl.Rule(JQ['alto']|JQ['Muito alto'], indice_social['alto']))
-regras_social.append(ctrl.Rule(JQ['medio'], indice_social['medio']))
-regras_social.append(ctrl.Rule(JQ['baixo']|JQ['muito_baixo'], indice_social['baixo']))
-regras_social.append(ctrl.Rule(TC['medio'], indice_social['medio']))
-regras_social.append(ctrl.Rule(TC['alto']|TC['Muito alto'], indice_social['alto']))
-regras_social.append(ctrl.Rule(TC['baixo']|TC['muito_baixo'], indice_social['baixo']))
-regras_social.append(ctrl.Rule(plano_saude['sim'], indice_social['alto']))
-regras_social.append(ctrl.Rule(plano_saude['nao'], indice_social['baixo']))
-
-sistema_social = ctrl.ControlSystem(regras_social)
-simulador_social = ctrl.ControlSystemSimulation(sistema_social)
+# Universos, termos e regras de cada sistema estão em modelo.json (ver SISTEMAS e configurar_modelo).
+# O sistema compilado e os objetos do skfuzzy só são construídos no primeiro uso (ver _compilado e _sistema_ctrl)
 
+@_funcao_de_calculo('social')
 def calcular_indice_social(anos_estudo_val, plano_saude_val, compartilha_lucros_val, JA_val, TC_val, JQ_val):
     """
-    Calcula o índice social a partir das 6 variáveis
+    Calcula o índice social a partir das 6 variáveis (None em caso de erro)
     """
-    try:
-        # Atribuir valores
-        simulador_social.input['Anos_de_estudo'] = anos_estudo_val
-        simulador_social.input['plano_saude'] = plano_saude_val
-        simulador_social.input['compartilha_lucros'] = compartilha_lucros_val
-        simulador_social.input['JA'] = JA_val
-        simulador_social.input['TC'] = TC_val
-        simulador_social.input['JQ'] = JQ_val
-        
-        # Computar
-        simulador_social.compute()
-        
-        return (simulador_social.output['indice_social']-20.83066751972702)*100/(80.55555555555556-20.83066751972702) 
-    
-    except Exception as e:
-        print(f"Erro no cálculo do índice social: {e}")
-        return None  # Valor padrão em caso de erro
+    resultado = _avaliar_escalar(_compilado('social'), {
+        'Anos_de_estudo': anos_estudo_val,
+        'plano_saude': plano_saude_val,
+        'compartilha_lucros': compartilha_lucros_val,
+        'JA': JA_val,
+        'TC': TC_val,
+        'JQ': JQ_val,
+    })
+    return _normalizar(resultado, _limites('social'))
+
+def calcular_indice_social_lote(*valores):
+    """
+    Versão vetorizada de calcular_indice_social para N fazendas.
+    Recebe os 6 arrays na mesma ordem da função escalar ou um DataFrame com as colunas
+    Anos_de_estudo, plano_saude, compartilha_lucros, JA, TC e JQ.
+    Retorna um array (N,) com NaN onde a função escalar retornaria None
+    """
+    entradas = _entradas_lote(valores, ['Anos_de_estudo', 'plano_saude', 'compartilha_lucros', 'JA', 'TC', 'JQ'])
+    return _normalizar(_compilado('social').avaliar(entradas), _limites('social'))
     
 #Econômicos
 #FV=(Valor monetário atual da Fazenda/Total de area produtiva(ha))**(1/Tempo adotando o sistema produtivo atual)
 #P=Lucro=Receita Total Bruta-Custo Total da produção/Area Produtiva Total
 #DL=%da receita usada para despesas/Total de area produtiva(ha))**(1/Tempo adotando o sistema produtivo atual)
 #WI=Salário do gerente,proprietário/Salário médio==3.225(média de salários no Brasil)
-FV = ctrl.Antecedent(np.arange(0, 120, 1), 'FV')
-WI = ctrl.Antecedent(np.arange(0, 11, 0.5), 'WI')
-P = ctrl.Antecedent(np.arange(0, 7000, 100), 'P')
-DL = ctrl.Antecedent(np.arange(0, 1.1, 0.1), 'DL')
-indice_economico = ctrl.Consequent(np.arange(0, 101, 1), 'indice_economico')
-
-# Regras
-FV['muito_baixo'] = fuzz.trimf(FV.universe, [0, 1, 2])
-FV['baixo'] = fuzz.trimf(FV.universe, [1, 3, 10])
-FV['medio'] = fuzz.trimf(FV.universe, [8, 20, 40])
-FV['alto'] = fuzz.trimf(FV.universe, [30, 60, 90])
-FV['muito_alto'] = fuzz.trapmf(FV.universe, [80, 100, 120, 120])
-        
-WI['muito_baixo'] = fuzz.trimf(WI.universe, [0, 1, 2])
-WI['baixo'] = fuzz.trimf(WI.universe, [1, 2, 4])
-WI['medio'] = fuzz.trimf(WI.universe, [3, 4, 6])
-WI['alto'] = fuzz.trimf(WI.universe, [5, 7, 9])
-WI['muito_alto'] = fuzz.trapmf(WI.universe, [8, 9, 11, 11])
-        
-P['muito_baixo'] = fuzz.trimf(P.universe, [0, 100, 1000])
-P['baixo'] = fuzz.trimf(P.universe, [500, 1500, 2500])
-P['medio'] = fuzz.trimf(P.universe, [2000, 3500, 5000])
-P['alto'] = fuzz.trimf(P.universe, [4500, 5500, 6500])
-P['muito_alto'] = fuzz.trapmf(P.universe, [6000, 6700, 7000, 7000])
-        
-DL['muito_baixo'] = fuzz.trimf(DL.universe, [0, 0, 0.1])
-DL['baixo'] = fuzz.trimf(DL.universe, [0.05, 0.15, 0.3])
-DL['medio'] = fuzz.trimf(DL.universe, [0.2, 0.35, 0.5])
-DL['alto'] = fuzz.trimf(DL.universe, [0.4, 0.6, 0.8])
-DL['muito_alto'] = fuzz.trapmf(DL.universe, [0.7, 0.85, 1, 1])
-        
-# Índice econômico (saída)
-indice_economico['muito_baixo'] = fuzz.trimf(indice_economico.universe, [0, 0, 25])
-indice_economico['baixo'] = fuzz.trimf(indice_economico.universe, [0, 25, 50])
-indice_economico['medio'] = fuzz.trimf(indice_economico.universe, [25, 50, 75])
-indice_economico['alto'] = fuzz.trapmf(indice_economico.universe, [50, 75, 100, 100])
-
-regras_economicas=[]
-regras_economicas.append(ctrl.Rule(DL['muito_alto'], indice_economico['muito_baixo']))
-regras_economicas.append(ctrl.Rule(DL['alto'], indice_economico['baixo']))
-regras_economicas.append(ctrl.Rule(DL['medio'], indice_economico['medio']))
-regras_economicas.append(ctrl.Rule(DL['baixo'], indice_economico['alto']))
-regras_economicas.append(ctrl.Rule(DL['muito_baixo'], indice_economico['alto']))
-regras_economicas.append(ctrl.Rule(WI['muito_alto'], indice_economico['alto']))
-regras_economicas.append(ctrl.Rule(WI['alto'], indice_economico['alto']))
-regras_economicas.append(ctrl.Rule(WI['medio'], indice_economico['medio']))
-regras_economicas.append(ctrl.Rule(WI['baixo'], indice_economico['baixo']))
-regras_economicas.append(ctrl.Rule(WI['muito_baixo'], indice_economico['muito_baixo']))
-regras_economicas.append(ctrl.Rule(P['muito_alto'], indice_economico['alto']))
-regras_economicas.append(ctrl.Rule(P['alto'], indice_economico['alto']))
-regras_economicas.append(ctrl.Rule(P['medio'], indice_economico['medio']))
-regras_economicas.append(ctrl.Rule(P['baixo'], indice_economico['baixo']))
-regras_economicas.append(ctrl.Rule(P['muito_baixo'], indice_economico['muito_baixo']))
-regras_economicas.append(ctrl.Rule(FV['muito_alto'], indice_economico['alto']))
-regras_economicas.append(ctrl.Rule(FV['alto'], indice_economico['alto']))
-regras_economicas.append(ctrl.Rule(FV['medio'], indice_economico['medio']))
-regras_economicas.append(ctrl.Rule(FV['baixo'], indice_economico['baixo']))
-regras_economicas.append(ctrl.Rule(FV['muito_baixo'], indice_economico['muito_baixo']))
-
-sistema_economico = ctrl.ControlSystem(regras_economicas)
-simulador_economico = ctrl.ControlSystemSimulation(sistema_economico)
-
+@_funcao_de_calculo('economico')
 def calcular_indice_economico(DL_val,FV_val,P_val,WI_val):
     """
-    Calcula o índice economico a partir das 6 variáveis
+    Calcula o índice economico a partir das 4 variáveis (None em caso de erro)
     """
-    try:
-        # Atribuir valores
-        simulador_economico.input['DL'] = DL_val
-        simulador_economico.input['FV'] = FV_val
-        simulador_economico.input['P'] = P_val
-        simulador_economico.input['WI'] = WI_val
-        
-        # Computar
-        simulador_economico.compute()
-        
-        return (simulador_economico.output['indice_economico']-8.333333333333332)*100/(80.55555555555556-8.333333333333332)
-   
-    except Exception as e:
-        print(f"Erro no cálculo do índice economico: {e}")
-        return None  # Valor padrão em caso de erro
+    resultado = _avaliar_escalar(_compilado('economico'), {'DL': DL_val, 'FV': FV_val, 'P': P_val, 'WI': WI_val})
+    return _normalizar(resultado, _limites('economico'))
+
+def calcular_indice_economico_lote(*valores):
+    """
+    Versão vetorizada de calcular_indice_economico para N fazendas.
+    Recebe os arrays DL, FV, P e WI (mesma ordem da função escalar) ou um DataFrame com essas colunas
+    """
+    entradas = _entradas_lote(valores, ['DL', 'FV', 'P', 'WI'])
+    return _normalizar(_compilado('economico').avaliar(entradas), _limites('economico'))
     
 #Ambiental
 #FO=%Area conservada/Regulamentação \\\\ %Area conservada=(Area total-Area produtiva)/Area total \\\\Regulamentação: 80% para a amazonia, 35% pro cerrado, 20% pro resto
@@ -207,158 +385,342 @@ Evapo={"AM":2221,"AC":1958,"RO":1750,"RR":1800,"AP":2182,"PA":2199,"DF":1304,"GO
                 "PR":1378,"ES":1756,"BA":1722,"SE":1804,"AL":1711,"PE":1932,"PB":2022,"RN":2062,"CE":1878,"PI":2668}
 #Escoamento=(Pluviosidade-Evapotranpiração)/Pluviosidade
 #consumo_area=Consumo de comsustivel(anual)/area total(ha) 
-FO = ctrl.Antecedent(np.arange(0, 1.1, 0.1), 'FO')
-Escoamento = ctrl.Antecedent(np.arange(-1, 1.1, 0.1), 'Escoamento')
-consumo_area = ctrl.Antecedent(np.arange(0, 40, 1), 'consumo_area')
-indice_ambiental = ctrl.Consequent(np.arange(0, 101, 1), 'indice_ambiental')
-
-# Regras
-Escoamento['muito_alto'] = fuzz.trimf(Escoamento.universe, [-1, -1, -0.2])
-Escoamento['alto'] = fuzz.trimf(Escoamento.universe, [-0.3, -0.1, 0.1])
-Escoamento['medio'] = fuzz.trimf(Escoamento.universe, [0, 0.2, 0.4])
-Escoamento['baixo'] = fuzz.trimf(Escoamento.universe, [0.3, 0.5, 0.7])
-Escoamento['muito_baixo'] = fuzz.trapmf(Escoamento.universe, [0.6, 0.8, 1, 1])
-
-consumo_area['muito_baixo'] = fuzz.trimf(consumo_area.universe, [0, 0, 3])       # < 3 L/ha (ótimo)
-consumo_area['baixo'] = fuzz.trimf(consumo_area.universe, [1, 4, 8])             # 2-8 L/ha (bom)
-consumo_area['medio'] = fuzz.trimf(consumo_area.universe, [6, 10, 15])           # 6-15 L/ha (médio)
-consumo_area['alto'] = fuzz.trimf(consumo_area.universe, [12, 18, 25])           # 12-25 L/ha (alto)
-consumo_area['muito_alto'] = fuzz.trapmf(consumo_area.universe, [20, 28, 40, 40]) # > 20 L/ha (crítico)
-        
-FO['muito_baixo'] = fuzz.trimf(FO.universe, [0, 0, 0.1])
-FO['baixo'] = fuzz.trimf(FO.universe, [0.05, 0.15, 0.3])
-FO['medio'] = fuzz.trimf(FO.universe, [0.2, 0.35, 0.5])
-FO['alto'] = fuzz.trimf(FO.universe, [0.4, 0.6, 0.8])
-FO['muito_alto'] = fuzz.trapmf(FO.universe, [0.7, 0.85, 1, 1])
-        
-# Índice econômico (saída)
-indice_ambiental['muito_baixo'] = fuzz.trimf(indice_ambiental.universe, [0, 0, 25])
-indice_ambiental['baixo'] = fuzz.trimf(indice_ambiental.universe, [0, 25, 50])
-indice_ambiental['medio'] = fuzz.trimf(indice_ambiental.universe, [25, 50, 75])
-indice_ambiental['alto'] = fuzz.trapmf(indice_ambiental.universe, [50, 75, 100, 100])
+def _indice_ambiental(Escoamento_val, FO_val, consumo_area_val):
+    """
+    Cálculo de calcular_indice_ambiental sem o decorador, para as funções que o reaproveitam
+    não contarem a chamada (e o erro) duas vezes
+    """
+    resultado = _avaliar_escalar(_compilado('ambiental'), {
+        'FO': FO_val,
+        'consumo_area': consumo_area_val,
+        'Escoamento': Escoamento_val,
+    })
+    return _normalizar(resultado, _limites('ambiental'))
+
+@_funcao_de_calculo('ambiental')
+def calcular_indice_ambiental(Escoamento_val,FO_val,consumo_area_val):
+    """
+    Calcula o índice ambiental a partir das 3 variáveis (None em caso de erro)
+    """
+    return _indice_ambiental(Escoamento_val, FO_val, consumo_area_val)
 
+def calcular_indice_ambiental_lote(*valores):
+    """
+    Versão vetorizada de calcular_indice_ambiental para N fazendas.
+    Recebe os arrays Escoamento, FO e consumo_area (mesma ordem da função escalar) ou um DataFrame com essas colunas
+    """
+    entradas = _entradas_lote(valores, ['Escoamento', 'FO', 'consumo_area'])
+    return _normalizar(_compilado('ambiental').avaliar(entradas), _limites('ambiental'))
+
+# ÍNDICE AMBIENTAL A PARTIR DOS DADOS BRUTOS DA FAZENDA
+# Campos do cadastro usados por calcular_indice_ambiental_fazendas (argumentos ou colunas do DataFrame)
+CAMPOS_FAZENDA = ['estado', 'area_total', 'area_produtiva', 'consumo_combustivel']
+def _tabela_estados():
+    compilado = _compilado('ambiental')
+    tabela = _tabelas_estado.get(compilado.assinatura())
+    if tabela is None:
+        ufs = sorted(Regulamentação)
+        escoamento = np.array([(Chuva[uf] - Evapo[uf]) / Chuva[uf] for uf in ufs] + [np.nan])
+        pertinencia = compilado.pertinencia('Escoamento', escoamento)
+        pertinencia[-1] = np.nan
+        tabela = {
+            'ufs': np.array(ufs),
+            'regulamentacao': np.array([Regulamentação[uf] for uf in ufs] + [np.nan]),
+            'escoamento': escoamento,
+            'pertinencia_escoamento': pertinencia,
+        }
+        with _trava_construcao:
+            _tabelas_estado.clear()
+            _tabelas_estado[compilado.assinatura()] = tabela
+    return tabela
+
+def _linhas_estado(estado, tabela):
+    """
+    Linha da tabela por estado de cada fazenda. As siglas são resolvidas uma vez por estado distinto
+    """
+    siglas = np.char.upper(np.char.strip(np.atleast_1d(np.asarray(estado, dtype=str))))
+    distintas, grupo = np.unique(siglas, return_inverse=True)
+    ufs = tabela['ufs']
+    posicao = np.minimum(np.searchsorted(ufs, distintas), ufs.size - 1)
+    linhas = np.where(ufs[posicao] == distintas, posicao, ufs.size)
+    return linhas[grupo]
+
+def _dados_fazendas(valores):
+    if len(valores) == 1 and hasattr(valores[0], 'keys'):
+        valores = [valores[0][campo] for campo in CAMPOS_FAZENDA]
+    if len(valores) != len(CAMPOS_FAZENDA):
+        raise TypeError(f"Esperados {len(CAMPOS_FAZENDA)} arrays ou um DataFrame, recebidos {len(valores)} argumentos")
+    estado, *numericos = valores
+    return (estado, *[np.atleast_1d(np.asarray(v, dtype=float)) for v in numericos])
+
+def _variaveis_ambientais(estado, area_total, area_produtiva, consumo_combustivel):
+    tabela = _tabela_estados()
+    linhas = _linhas_estado(estado, tabela)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area_total = np.where(area_total > 0, area_total, np.nan)
+        entradas = {
+            'FO': (area_total - area_produtiva) / area_total / tabela['regulamentacao'][linhas],
+            'consumo_area': consumo_combustivel / area_total,
+        }
+    return entradas, linhas, tabela
+
+def variaveis_ambientais(*valores):
+    """
+    FO, Escoamento e consumo_area de N fazendas a partir de estado (UF), área total (ha),
+    área produtiva (ha) e consumo anual de combustível (L), em arrays ou num DataFrame com CAMPOS_FAZENDA.
+    Estado desconhecido ou área total <= 0 resultam em NaN
+    """
+    entradas, linhas, tabela = _variaveis_ambientais(*_dados_fazendas(valores))
+    entradas['Escoamento'] = tabela['escoamento'][linhas]
+    return entradas
 
-regras_ambientais=[]
-regras_ambientais.append(ctrl.Rule(Escoamento['medio'], indice_ambiental['alto']))
-regras_ambientais.append(ctrl.Rule(Escoamento['baixo'] | Escoamento['alto'], indice_ambiental['medio']))
-regras_ambientais.append(ctrl.Rule(Escoamento['muito_baixo'] | Escoamento['muito_alto'], indice_ambiental['baixo']))
-regras_ambientais.append(ctrl.Rule(FO['baixo'], indice_ambiental['baixo']))
-regras_ambientais.append(ctrl.Rule(FO['muito_baixo'], indice_ambiental['muito_baixo']))
-regras_ambientais.append(ctrl.Rule(FO['alto'], indice_ambiental['alto']))
-regras_ambientais.append(ctrl.Rule(FO['muito_alto'], indice_ambiental['alto']))
-regras_ambientais.append(ctrl.Rule(FO['medio'], indice_ambiental['medio']))
-regras_ambientais.append(ctrl.Rule(consumo_area['muito_baixo'], indice_ambiental['alto']))
-regras_ambientais.append(ctrl.Rule(consumo_area['baixo'], indice_ambiental['alto']))
-regras_ambientais.append(ctrl.Rule(consumo_area['medio'], indice_ambiental['medio']))
-regras_ambientais.append(ctrl.Rule(consumo_area['alto'], indice_ambiental['baixo']))
-regras_ambientais.append(ctrl.Rule(consumo_area['muito_alto'], indice_ambiental['muito_baixo']))
+@_funcao_de_calculo('ambiental_fazenda')
+def calcular_indice_ambiental_fazenda(estado, area_total, area_produtiva, consumo_combustivel):
+    """
+    Calcula o índice ambiental a partir dos dados do cadastro da fazenda
+    (UF, área total e produtiva em ha, consumo anual de combustível em L)
+    """
+    if str(estado).strip().upper() not in Regulamentação:
+        raise ValueError(f"Estado desconhecido: {estado}")
+    if not area_total > 0:
+        raise ValueError("A área total deve ser maior que zero")
+    entradas = variaveis_ambientais(estado, area_total, area_produtiva, consumo_combustivel)
+    return _indice_ambiental(entradas['Escoamento'][0], entradas['FO'][0], entradas['consumo_area'][0])
+
+def calcular_indice_ambiental_fazendas(*valores):
+    """
+    Versão vetorizada de calcular_indice_ambiental_fazenda para N fazendas.
+    Recebe os arrays estado, area_total, area_produtiva e consumo_combustivel ou um DataFrame com essas colunas.
+    O escoamento não é fuzzificado por fazenda: as pertinências de cada estado vêm da tabela por estado
+    """
+    entradas, linhas, tabela = _variaveis_ambientais(*_dados_fazendas(valores))
+    pertinencia_escoamento = tabela['pertinencia_escoamento'][linhas]
+    resultado = _compilado('ambiental').avaliar(entradas, pre_fuzzificadas={'Escoamento': pertinencia_escoamento})
+    return _normalizar(resultado, _limites('ambiental'))
 
+# MODO TABELA (opcional): a sustentabilidade é interpolada numa grade pré-calculada
+def ativar_modo_lut(resolucao=101, diretorio=None):
+    """
+    Passa calcular_sustentabilidade(_lote) a usar interpolação trilinear numa grade
+    resolucao x resolucao x resolucao salva em disco (.npy, aberta com memory-map).
+    A grade é reconstruída automaticamente se as pertinências ou regras mudarem.
+    diretorio: onde a grade é gravada (padrão: motor.diretorio_cache(), fora do pacote).
+    Retorna a TabelaConsulta; erro_maximo_indice traz o maior erro medido contra o Mamdani exato, na
+    escala 0-100 da sustentabilidade
+    """
+    global tabela_sustentabilidade
+    tabela_sustentabilidade = TabelaConsulta(_compilado('sustentabilidade'), resolucao, diretorio,
+                                             limites=_limites('sustentabilidade'))
+    return tabela_sustentabilidade
 
+def desativar_modo_lut():
+    """
+    Volta ao cálculo exato da sustentabilidade
+    """
+    global tabela_sustentabilidade
+    tabela_sustentabilidade = None
+
+# CACHE (opcional) das funções escalares calcular_indice_* e calcular_sustentabilidade
+def ativar_cache(tamanho=4096, quantizacao=None, sistemas=None):
+    """
+    Coloca um cache LRU de até `tamanho` resultados na frente das funções escalares de cada sistema
+    ('social', 'economico', 'ambiental', 'sustentabilidade'; todos por padrão).
+    quantizacao: passo de arredondamento por variável, ex. {'JA': 0.01, 'P': 10, 'economico': 0.5};
+    variáveis sem passo entram no cache pelo valor exato.
+    Retorna os caches criados, por nome do sistema
+    """
+    criados = {}
+    for nome in sistemas or SISTEMAS:
+        modelo = SISTEMAS[nome]
+        criados[nome] = _caches[modelo['consequente'][0]] = CacheLRU(modelo['antecedentes'], tamanho, quantizacao)
+    return criados
 
-sistema_ambiental = ctrl.ControlSystem(regras_ambientais)
-simulador_ambiental = ctrl.ControlSystemSimulation(sistema_ambiental)
+def desativar_cache(sistemas=None):
+    """
+    Remove os caches (de todos os sistemas por padrão)
+    """
+    for nome in sistemas or SISTEMAS:
+        _caches.pop(SISTEMAS[nome]['consequente'][0], None)
 
-def calcular_indice_ambiental(Escoamento_val,FO_val,consumo_area_val):
+def estatisticas_cache():
     """
-    Calcula o índice ambiental a partir das 6 variáveis
+    Acertos, falhas, descartes (por falta de espaço), invalidações (sistema alterado) e itens de cada cache ativo
     """
-    try:
-        # Atribuir valores
-        simulador_ambiental.input['FO'] = FO_val
-        simulador_ambiental.input['consumo_area'] = consumo_area_val
-        simulador_ambiental.input['Escoamento'] = Escoamento_val
-        
-        # Computar
-        simulador_ambiental.compute()
-        
-        return (simulador_ambiental.output['indice_ambiental']-20.83066751972702)*100/(80.55555555555556-20.83066751972702)
-    
-    except Exception as e:
-        print(f"Erro no cálculo do índice ambiental: {e}")
-        return None  # Valor padrão em caso de erro
-
-# Variáveis de entrada Sustentabilidade
-economico = ctrl.Antecedent(np.arange(0, 101, 1), 'economico')
-social = ctrl.Antecedent(np.arange(0, 101, 1), 'social')  
-ambiental = ctrl.Antecedent(np.arange(0, 101, 1), 'ambiental')
-# Variável de saída
-sustentabilidade = ctrl.Consequent(np.arange(0, 101, 1), 'sustentabilidade')
-
-# CONJUNTOS FUZZY
-economico['muito_baixo'] = fuzz.trimf(economico.universe, [0, 0, 25])
-economico['baixo'] = fuzz.trimf(economico.universe, [0, 25, 50])
-economico['medio'] = fuzz.trimf(economico.universe, [25, 50, 75])
-economico['alto'] = fuzz.trapmf(economico.universe, [50, 75, 100, 100])
-
-social['muito_baixo'] = fuzz.trimf(social.universe, [0, 0, 25])
-social['baixo'] = fuzz.trimf(social.universe, [0, 25, 50])
-social['medio'] = fuzz.trimf(social.universe, [25, 50, 75])
-social['alto'] = fuzz.trapmf(social.universe, [50, 75, 100, 100])
-
-ambiental['muito_baixo'] = fuzz.trimf(ambiental.universe, [0, 0, 25])
-ambiental['baixo'] = fuzz.trimf(ambiental.universe, [0, 25, 50])
-ambiental['medio'] = fuzz.trimf(ambiental.universe, [25, 50, 75])
-ambiental['alto'] = fuzz.trapmf(ambiental.universe, [50, 75, 100, 100])
-
-sustentabilidade['muito_baixo'] = fuzz.trimf(sustentabilidade.universe, [0, 0, 25])
-sustentabilidade['baixo'] = fuzz.trimf(sustentabilidade.universe, [0, 25, 50])
-sustentabilidade['medio'] = fuzz.trimf(sustentabilidade.universe, [25, 50, 75])
-sustentabilidade['alto'] = fuzz.trapmf(sustentabilidade.universe, [50, 75, 100, 100])
-
-# REGRAS FUZZY
-# Regra 1: Se qualquer input é muito baixo, o output é muito baixo
-regra1 = ctrl.Rule(economico['muito_baixo'] | social['muito_baixo'] | ambiental['muito_baixo'], 
-                   sustentabilidade['muito_baixo'])
-
-# Regra 2: Se qualquer input é baixo, o output é baixo
-regra2 = ctrl.Rule(economico['baixo'] | social['baixo'] | ambiental['baixo'], 
-                   sustentabilidade['baixo'])
-
-# Regra 3: Se há pelo menos dois inputs Médios, o output é médio
-regra3 = ctrl.Rule((economico['medio'] & social['medio']) | 
-                   (economico['medio'] & ambiental['medio']) | 
-                   (social['medio'] & ambiental['medio']), 
-                   sustentabilidade['medio'])
-
-# Regra 4: Se há pelo menos dois inputs Altos, o output é alto
-regra4 = ctrl.Rule((economico['alto'] & social['alto']) | 
-                   (economico['alto'] & ambiental['alto']) | 
-                   (social['alto'] & ambiental['alto']), 
-                   sustentabilidade['alto'])
-
-# SISTEMA DE CONTROLE
-sistema_controle = ctrl.ControlSystem([regra1, regra2, regra3, regra4])
-sistema = ctrl.ControlSystemSimulation(sistema_controle)
+    return {nome: _caches[modelo['consequente'][0]].estatisticas()
+            for nome, modelo in SISTEMAS.items() if modelo['consequente'][0] in _caches}
+
+# ANÁLISE DE CENÁRIOS ("e se"): variações de uma ou duas variáveis de uma fazenda
+# As fazendas de referência já fuzzificadas ficam num cache pequeno, para chamadas repetidas (ex. um slider)
+_referencias = {}
+
+def _fora_da_faixa(nome, valores):
+    """
+    Na sustentabilidade, entradas fora de 0-100 viram NaN, como nas funções escalares e em lote
+    """
+    valores = np.asarray(valores, dtype=float)
+    if nome != 'sustentabilidade':
+        return valores
+    return np.where((valores < 0) | (valores > 100), np.nan, valores)
+
+def analisar_cenarios(indice, fazenda, variacoes=None, grade=None):
+    """
+    Índice de uma fazenda sob variações, calculadas de uma vez.
+    indice: 'social', 'economico', 'ambiental' ou 'sustentabilidade'
+    fazenda: dict rótulo -> valor com as entradas do sistema (ex. {'Anos_de_estudo': 10, 'plano_saude': 0, ...})
+    variacoes: lista de cenários, cada um um dict {rótulo: novo valor} com uma ou duas variáveis,
+               ex. [{'plano_saude': 1}, {'TC': fazenda['TC'] + 3}]
+    grade: {rótulo: valores} com uma ou duas variáveis; avalia todas as combinações
+    Retorna {'base': índice da fazenda, 'indices': array, 'ganho': indices - base}; com grade, os arrays
+    têm o formato da grade (valores da 1ª variável x valores da 2ª). NaN onde o índice não é calculável
+    """
+    if (variacoes is None) == (grade is None):
+        raise TypeError("Informe variacoes ou grade")
+    modelo = SISTEMAS[indice]
+    compilado = _compilado(indice)
+    cache = _referencias.get(indice)
+    if cache is None:
+        cache = _referencias[indice] = CacheLRU(modelo['antecedentes'], tamanho=64)
+    base = {r: _fora_da_faixa(indice, fazenda[r]) for r in compilado.variaveis}
+    referencia = cache.consultar(compilado, base, lambda valores: Cenarios(compilado, valores))
+
+    if grade is not None:
+        if not 1 <= len(grade) <= 2:
+            raise ValueError("A grade deve variar uma ou duas variáveis")
+        eixos = np.meshgrid(*[_fora_da_faixa(indice, v) for v in grade.values()], indexing='ij')
+        forma = eixos[0].shape
+        grupos = [dict(zip(grade, eixos))]
+    else:
+        forma = (len(variacoes),)
+        grupos = [{r: _fora_da_faixa(indice, [v]) for r, v in cenario.items()} for cenario in variacoes]
+
+    limites = _limites(indice)
+    indices = _normalizar(referencia.avaliar(grupos), limites).reshape(forma)
+    base = _normalizar(referencia.resultado, limites)
+    return {'base': None if np.isnan(base) else float(base), 'indices': indices, 'ganho': indices - base}
+
+def _sistema_sustentabilidade():
+    return _compilado('sustentabilidade') if tabela_sustentabilidade is None else tabela_sustentabilidade
 
 # FUNÇÃO  SUSTENTABILIDADE
+@_funcao_de_calculo('sustentabilidade')
 def calcular_sustentabilidade(economico_val, social_val, ambiental_val):
     """
     Recebe 3 inputs (0-100) e retorna a sustentabilidade (0-100)
     usando lógica fuzzy com método de Mamdani e defuzzificação por centroide   
     Argumentos: economico_val: Valor econômico (0-100), social_val: Valor social (0-100), ambiental_val: Valor ambiental (0-100)    
     Retorna:
-        float: Valor de sustentabilidade entre 0-100
+        float: Valor de sustentabilidade entre 0-100 (None em caso de erro)
     """
-    try:
-        # Validar inputs
-        for nome, valor in [('Econômico', economico_val), ('Social', social_val), ('Ambiental', ambiental_val)]:
-            if valor < 0 or valor > 100:
-                raise ValueError(f"Valor {nome} deve estar entre 0-100")
-        
-        # Atribuir os valores de entrada
-        sistema.input['economico'] = economico_val
-        sistema.input['social'] = social_val
-        sistema.input['ambiental'] = ambiental_val
-        
-        # Computar o resultado
-        sistema.compute()
-        
-        # Retornar o valor defuzzificado
-        return (sistema.output['sustentabilidade']-8.33)*100/(80.56-8.33)
-    
-    except Exception as e:
-        print(f"Erro no cálculo: {e}")
-        return None
+    entradas = {
+        'economico': economico_val,
+        'social': social_val,
+        'ambiental': ambiental_val,
+    }
+    # Validar inputs
+    _conferir_entradas(entradas)
+    for nome, valor in [('Econômico', economico_val), ('Social', social_val), ('Ambiental', ambiental_val)]:
+        if valor < 0 or valor > 100:
+            raise ValueError(f"Valor {nome} deve estar entre 0-100")
+
+    # Computar o resultado
+    resultado = _avaliar_escalar(_sistema_sustentabilidade(), entradas)
+
+    # Retornar o valor defuzzificado
+    return _normalizar(resultado, _limites('sustentabilidade'))
+
+def calcular_sustentabilidade_lote(*valores):
+    """
+    Versão vetorizada de calcular_sustentabilidade para N fazendas.
+    Recebe os arrays economico, social e ambiental (0-100) ou um DataFrame com essas colunas.
+    Valores fora de 0-100 resultam em NaN, como o None da função escalar
+    """
+    entradas = _entradas_lote(valores, ['economico', 'social', 'ambiental'])
+    entradas = {rotulo: np.where((v < 0) | (v > 100), np.nan, v) for rotulo, v in entradas.items()}
+    return _normalizar(_sistema_sustentabilidade().avaliar(entradas), _limites('sustentabilidade'))
+
+# OS QUATRO ÍNDICES DE UMA VEZ
+# Variáveis de pontuar_fazenda(s), na ordem dos argumentos: social, econômico e ambiental
+ENTRADAS = ['Anos_de_estudo', 'plano_saude', 'compartilha_lucros', 'JA', 'TC', 'JQ',
+            'DL', 'FV', 'P', 'WI', 'Escoamento', 'FO', 'consumo_area']
+INDICES = ['economico', 'social', 'ambiental', 'sustentabilidade']
+
+def _encadeamento():
+    """
+    Os três sistemas dos índices alimentando o da sustentabilidade (sempre o Mamdani, mesmo no modo LUT)
+    """
+    etapas = {nome: _compilado(nome) for nome in INDICES[:3]}
+    return Encadeamento(etapas, _compilado('sustentabilidade'), {nome: _limites(nome) for nome in INDICES})
+
+def _pertinencias(encadeamento, graus):
+    """
+    Pertinências por variável e termo ({rótulo: {termo: coluna de graus}}), nos termos do modelo
+    """
+    termos = {rotulo: list(definicao) for modelo in SISTEMAS.values()
+              for rotulo, (_, definicao) in modelo['antecedentes'].items()}
+    return {rotulo: dict(zip(termos[rotulo], graus[:, colunas].T))
+            for rotulo, colunas in encadeamento.colunas.items()}
+
+def pontuar_fazendas(*valores, pertinencias=True, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Calcula os quatro índices de N fazendas numa só passada, a partir das 13 variáveis.
+    Recebe os 13 arrays (ou escalares) na ordem de ENTRADAS ou um DataFrame/dict com essas colunas.
+    Retorna {'indices': {'economico', 'social', 'ambiental', 'sustentabilidade': array (N,)},
+    'pertinencias': {rótulo: {termo: array (N,)}}}, com as pertinências das 13 variáveis e as dos três
+    índices na sustentabilidade. As saídas são alocadas uma vez e as fazendas calculadas em blocos de
+    tamanho_bloco; pertinencias=False dispensa a matriz de pertinências (N x 71) em lotes grandes.
+    NaN onde as funções calcular_*_lote dariam NaN
+    """
+    encadeamento = _encadeamento()
+    indices, graus = encadeamento.avaliar(_entradas_lote(valores, ENTRADAS), tamanho_bloco, pertinencias)
+    return {'indices': indices,
+            'pertinencias': None if graus is None else _pertinencias(encadeamento, graus)}
+
+@_funcao_de_calculo('fazenda')
+def pontuar_fazenda(Anos_de_estudo, plano_saude, compartilha_lucros, JA, TC, JQ, DL, FV, P, WI,
+                    Escoamento, FO, consumo_area):
+    """
+    Versão escalar de pontuar_fazendas: os quatro índices (None onde não calculáveis) e as pertinências
+    ({rótulo: {termo: grau}}) de uma fazenda. Aceita pontuar_fazenda(**fazenda)
+    """
+    encadeamento = _encadeamento()
+    indices, graus = encadeamento.avaliar(dict(zip(ENTRADAS, (
+        Anos_de_estudo, plano_saude, compartilha_lucros, JA, TC, JQ, DL, FV, P, WI, Escoamento, FO, consumo_area))))
+    return {'indices': {nome: None if np.isnan(v[0]) else float(v[0]) for nome, v in indices.items()},
+            'pertinencias': {rotulo: {termo: float(g[0]) for termo, g in termos.items()}
+                             for rotulo, termos in _pertinencias(encadeamento, graus).items()}}
+
+# VERIFICAÇÃO DO MOTOR COMPILADO
+def verificar_equivalencia(n=200, semente=0):
+    """
+    Compara os sistemas compilados com os simuladores do skfuzzy em n entradas aleatórias
+    (sorteadas um pouco além de cada universo para cobrir o recorte).
+    Retorna a maior diferença absoluta da saída defuzzificada de cada sistema
+    """
+    rng = np.random.default_rng(semente)
+    diferencas = {}
+    for nome in SISTEMAS:
+        sistema_ctrl, compilado = _sistema_ctrl(nome), _compilado(nome)
+        simulador = simulador_da_thread(sistema_ctrl)
+        entradas = {}
+        for variavel in sistema_ctrl.antecedents:
+            minimo, maximo = variavel.universe.min(), variavel.universe.max()
+            margem = 0.05*(maximo - minimo)
+            entradas[variavel.label] = rng.uniform(minimo - margem, maximo + margem, n)
+        compilados = compilado.avaliar(entradas)
+
+        referencia = np.empty(n)
+        for i in range(n):
+            for rotulo, valores in entradas.items():
+                simulador.input[rotulo] = valores[i]
+            try:
+                simulador.compute()
+                referencia[i] = simulador.output[compilado.saida]
+            except (KeyError, ValueError):
+                referencia[i] = np.nan
+        if not np.array_equal(np.isnan(referencia), np.isnan(compilados)):
+            raise AssertionError(f"'{compilado.saida}': saídas indefinidas divergem do skfuzzy")
+        diferencas[compilado.saida] = float(np.nanmax(np.abs(referencia - compilados), initial=0.0))
+    return diferencas
 
 # FUNÇÃO PARA VISUALIZAR O CÁLCULO
 def visualizar_calculo(economico_val, social_val, ambiental_val):
@@ -372,11 +734,19 @@ def visualizar_calculo(economico_val, social_val, ambiental_val):
         print(f"Sustentabilidade: {resultado:.2f}")
         print("=" * 40)
         
-        # Visualizar a saída
-        sustentabilidade.view(sim=sistema)
+        # Visualizar a saída (o gráfico usa o estado da simulação do skfuzzy)
+        import matplotlib.pyplot as plt
+        simulador = simulador_da_thread(_sistema_ctrl('sustentabilidade'))
+        simulador.input['economico'] = economico_val
+        simulador.input['social'] = social_val
+        simulador.input['ambiental'] = ambiental_val
+        simulador.compute()
+        next(simulador.ctrl.consequents).view(sim=simulador)
         plt.title(f'Sustentabilidade: {resultado:.2f}')
         plt.show()
         
     return resultado
-print(calcular_indice_ambiental(-1,0,40))
+
+if __name__ == '__main__':
+    print(calcular_indice_ambiental(-1,0,40))
 
@@ -0,0 +1,424 @@
+"""
+Benchmarks do cálculo fuzzy.
+
+Uso (a partir da pasta fuzzy/):
+    python benchmark.py completo [--saida resultado.json] [--rapido]
+    python benchmark.py comparar base.json novo.json [--tolerancia 0.1]
+    python benchmark.py latencia [--chamadas 2000]
+    python benchmark.py vazao [--tamanhos 1000 100000 1000000]
+    python benchmark.py memoria [--fazendas 100000]
+    python benchmark.py concorrencia [--fazendas 20000] [--trabalhadores 1 2 4 8]
+    python benchmark.py importacao [--repeticoes 5]
+    python benchmark.py modelos [--variantes 100]
+
+completo: roda todas as medidas abaixo e grava um JSON com as métricas e os metadados da execução
+(commit, versões, núcleos). comparar: compara dois desses JSONs (ex. de dois commits) e lista as
+métricas que pioraram mais que a tolerância; termina com código 1 se houver alguma.
+latencia: tempo de uma chamada de cada função escalar (mediana, p95 e p99).
+vazao: fazendas por segundo das funções em lote em cada tamanho de lote.
+memoria: pico de memória alocada pelas funções em lote.
+concorrencia: teste de estresse (threads chamando as funções escalares ao mesmo tempo devem obter
+exatamente os resultados do cálculo serial) e vazão do cálculo em lote com threads e processos.
+importacao: tempo de partida a frio, cada medida num interpretador novo (nada é lido de
+fuzzy/.cache; os limites de normalização vêm de modelo.json).
+modelos: leitura e compilação de variantes do modelo.json (cada uma muda um termo de um sistema) e
+memória ocupada com todas carregadas ao mesmo tempo.
+
+Todos os dados são sintéticos, sorteados dentro do universo de cada variável com semente fixa.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import Fuzzy
+import motor
+
+# Argumentos de cada função escalar, na ordem da assinatura
+ARGUMENTOS = {
+    'social': ['Anos_de_estudo', 'plano_saude', 'compartilha_lucros', 'JA', 'TC', 'JQ'],
+    'economico': ['DL', 'FV', 'P', 'WI'],
+    'ambiental': ['Escoamento', 'FO', 'consumo_area'],
+    'sustentabilidade': ['economico', 'social', 'ambiental'],
+}
+FUNCOES = {
+    'social': (Fuzzy.calcular_indice_social, Fuzzy.calcular_indice_social_lote),
+    'economico': (Fuzzy.calcular_indice_economico, Fuzzy.calcular_indice_economico_lote),
+    'ambiental': (Fuzzy.calcular_indice_ambiental, Fuzzy.calcular_indice_ambiental_lote),
+    'sustentabilidade': (Fuzzy.calcular_sustentabilidade, Fuzzy.calcular_sustentabilidade_lote),
+}
+# Variáveis que o questionário só produz como inteiros (0/1 ou contagens)
+DISCRETAS = {'plano_saude', 'compartilha_lucros', 'Anos_de_estudo', 'TC'}
+
+
+def gerar_fazendas(n, semente=0):
+    """
+    Dados sintéticos: cada variável sorteada uniformemente dentro do próprio universo
+    """
+    rng = np.random.default_rng(semente)
+    dados = {}
+    for compilado in (Fuzzy.compilado_social, Fuzzy.compilado_economico,
+                      Fuzzy.compilado_ambiental, Fuzzy.compilado_sustentabilidade):
+        for rotulo, universo in zip(compilado.variaveis, compilado.universos):
+            if rotulo in DISCRETAS:
+                dados[rotulo] = rng.integers(universo[0], universo[-1], n, endpoint=True).astype(float)
+            else:
+                dados[rotulo] = rng.uniform(universo[0], universo[-1], n)
+    return dados
+
+
+def _calcular_lote(indice, dados):
+    return FUNCOES[indice][1](*[dados[a] for a in ARGUMENTOS[indice]])
+
+
+def _calcular_fatia(indice, dados, posicoes):
+    escalar = FUNCOES[indice][0]
+    colunas = [dados[a] for a in ARGUMENTOS[indice]]
+    return [escalar(*[c[i] for c in colunas]) for i in posicoes]
+
+
+def estresse_threads(dados, trabalhadores, fatia=64, semente=0):
+    """
+    Várias threads calculam fazendas embaralhadas com as funções escalares ao mesmo tempo.
+    Retorna, por índice, quantos resultados divergem do cálculo serial em lote
+    """
+    rng = np.random.default_rng(semente)
+    n = next(iter(dados.values())).size
+    divergencias = {}
+    for indice in ARGUMENTOS:
+        esperado = _calcular_lote(indice, dados)
+        ordem = rng.permutation(n)
+        fatias = [ordem[i:i + fatia] for i in range(0, n, fatia)]
+        obtido = np.empty(n)
+        with ThreadPoolExecutor(trabalhadores) as executor:
+            for posicoes, resultados in zip(fatias, executor.map(lambda p: _calcular_fatia(indice, dados, p), fatias)):
+                obtido[posicoes] = [np.nan if r is None else r for r in resultados]
+        divergencias[indice] = int((~np.isclose(obtido, esperado, rtol=0, atol=1e-9, equal_nan=True)).sum())
+    return divergencias
+
+
+def estresse_simuladores(trabalhadores, n=40, semente=0):
+    """
+    Simuladores do skfuzzy por thread (simulador_da_thread) usados ao mesmo tempo:
+    cada thread deve reproduzir o sistema compilado. Retorna o número de divergências
+    """
+    dados = gerar_fazendas(n * trabalhadores, semente)
+    esperado = Fuzzy.compilado_social.avaliar(dados)
+
+    def calcular(posicoes):
+        simulador = Fuzzy.simulador_da_thread(Fuzzy.sistema_social)
+        saida = []
+        for i in posicoes:
+            for rotulo in ARGUMENTOS['social']:
+                simulador.input[rotulo] = dados[rotulo][i]
+            simulador.compute()
+            saida.append(simulador.output['indice_social'])
+        return saida
+
+    fatias = np.array_split(np.arange(n * trabalhadores), trabalhadores)
+    with ThreadPoolExecutor(trabalhadores) as executor:
+        obtido = np.concatenate([np.asarray(r) for r in executor.map(calcular, fatias)])
+    return int((~np.isclose(obtido, esperado, rtol=0, atol=1e-9)).sum())
+
+
+def _vazao(executor_cls, trabalhadores, dados, blocos):
+    n = next(iter(dados.values())).size
+    partes = [{r: v[p] for r, v in dados.items()} for p in np.array_split(np.arange(n), blocos)]
+    with executor_cls(trabalhadores) as executor:
+        list(executor.map(_calcular_lote, ['social'] * trabalhadores, partes[:trabalhadores]))  # aquecimento
+        inicio = time.perf_counter()
+        for indice in ARGUMENTOS:
+            list(executor.map(_calcular_lote, [indice] * len(partes), partes))
+        duracao = time.perf_counter() - inicio
+    return n / duracao
+
+
+def benchmark_concorrencia(n_fazendas, lista_trabalhadores):
+    dados = gerar_fazendas(n_fazendas)
+    resultado = {'fazendas': n_fazendas, 'estresse': {}, 'vazao_fazendas_por_s': {}}
+    for t in lista_trabalhadores:
+        amostra = {r: v[:min(n_fazendas, 4000)] for r, v in dados.items()}
+        resultado['estresse'][t] = {'funcoes_escalares': estresse_threads(amostra, t),
+                                    'simuladores_skfuzzy': estresse_simuladores(t)}
+        resultado['vazao_fazendas_por_s'][t] = {
+            'threads': _vazao(ThreadPoolExecutor, t, dados, blocos=4 * t),
+            'processos': _vazao(ProcessPoolExecutor, t, dados, blocos=4 * t),
+        }
+    return resultado
+
+
+# Etapas medidas na partida a frio; cada uma roda num processo novo
+PARTIDA_A_FRIO = {
+    # Só importar o módulo
+    'importar': 'import Fuzzy',
+    # Importar e calcular uma fazenda em cada índice (compila os quatro sistemas)
+    'primeiro_calculo': ('import Fuzzy\n'
+                         'Fuzzy.calcular_indice_social(10, 1, 0, 0.5, 5, 6)\n'
+                         'Fuzzy.calcular_indice_economico(0.3, 20, 3000, 4)\n'
+                         'Fuzzy.calcular_indice_ambiental(0.2, 0.5, 3)\n'
+                         'Fuzzy.calcular_sustentabilidade(50, 50, 50)'),
+    # Importar e construir todos os objetos do skfuzzy, o que antes acontecia na importação
+    'construir_skfuzzy': ('import Fuzzy\n'
+                          'for nome in Fuzzy.SISTEMAS:\n'
+                          '    Fuzzy._simulador(nome)'),
+}
+
+
+def _tempo_subprocesso(codigo):
+    medidor = ('import time\n'
+               '_inicio = time.perf_counter()\n'
+               f'{codigo}\n'
+               'print(time.perf_counter() - _inicio)')
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    saida = subprocess.run([sys.executable, '-c', medidor], cwd=pasta, check=True,
+                           capture_output=True, text=True).stdout
+    return float(saida.strip().splitlines()[-1])
+
+
+def benchmark_importacao(repeticoes):
+    """
+    Mediana (s) de cada etapa da partida a frio em `repeticoes` interpretadores novos
+    """
+    return {etapa: statistics.median(_tempo_subprocesso(codigo) for _ in range(repeticoes))
+            for etapa, codigo in PARTIDA_A_FRIO.items()}
+
+
+def benchmark_latencia(chamadas, semente=0):
+    """
+    Microssegundos por chamada de cada função escalar, sobre `chamadas` fazendas diferentes
+    """
+    dados = gerar_fazendas(chamadas, semente)
+    resultado = {}
+    for indice, (escalar, _) in FUNCOES.items():
+        argumentos = list(zip(*[dados[a].tolist() for a in ARGUMENTOS[indice]]))
+        for args in argumentos[:50]:  # aquecimento (compilação do sistema)
+            escalar(*args)
+        tempos = []
+        for args in argumentos:
+            inicio = time.perf_counter_ns()
+            escalar(*args)
+            tempos.append(time.perf_counter_ns() - inicio)
+        tempos = np.array(tempos) / 1e3
+        resultado[indice] = {'mediana_us': float(np.median(tempos)),
+                             'p95_us': float(np.percentile(tempos, 95)),
+                             'p99_us': float(np.percentile(tempos, 99))}
+    return resultado
+
+
+def benchmark_vazao(tamanhos, semente=0):
+    """
+    Fazendas por segundo de cada função em lote, para cada tamanho de lote
+    """
+    dados = gerar_fazendas(max(tamanhos), semente)
+    for indice in ARGUMENTOS:
+        _calcular_lote(indice, {r: v[:100] for r, v in dados.items()})  # aquecimento
+    resultado = {}
+    for n in tamanhos:
+        parte = {r: v[:n] for r, v in dados.items()}
+        repeticoes = max(1, min(5, 100000 // n))
+        resultado[n] = {}
+        for indice in ARGUMENTOS:
+            duracao = min(_cronometrar(_calcular_lote, indice, parte) for _ in range(repeticoes))
+            resultado[n][indice] = {'fazendas_por_s': n / duracao}
+    return resultado
+
+
+def _cronometrar(funcao, *args):
+    inicio = time.perf_counter()
+    funcao(*args)
+    return time.perf_counter() - inicio
+
+
+def benchmark_memoria(n_fazendas, semente=0):
+    """
+    Pico de memória alocada (MB, tracemalloc) por cada função em lote com n_fazendas
+    """
+    dados = gerar_fazendas(n_fazendas, semente)
+    _calcular_lote('social', {r: v[:10] for r, v in dados.items()})
+    resultado = {}
+    for indice in ARGUMENTOS:
+        tracemalloc.start()
+        _calcular_lote(indice, dados)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        resultado[indice] = {'pico_mb': pico / 2**20}
+    return resultado
+
+
+def benchmark_escalonamento(n_fazendas, lista_trabalhadores):
+    """
+    Vazão (fazendas/s, os quatro índices) com 1, 2, 4, ... threads e processos
+    """
+    dados = gerar_fazendas(n_fazendas)
+    return {t: {'threads_fazendas_por_s': _vazao(ThreadPoolExecutor, t, dados, blocos=4 * t),
+                'processos_fazendas_por_s': _vazao(ProcessPoolExecutor, t, dados, blocos=4 * t)}
+            for t in lista_trabalhadores}
+
+
+def benchmark_modelos(variantes, semente=0):
+    """
+    Variantes do modelo em uso, cada uma com um parâmetro de um termo alterado: tempo de leitura e de
+    compilação por variante, memória (MB, tracemalloc) com todas carregadas e compiladas, e quantos
+    sistemas compilados distintos elas ocupam (os sistemas iguais entre variantes são compartilhados)
+    """
+    rng = np.random.default_rng(semente)
+    base = Fuzzy.modelo_atual()
+    nomes = list(base.sistemas)
+    with tempfile.TemporaryDirectory() as pasta:
+        caminhos = []
+        for i in range(variantes):
+            sistemas = json.loads(json.dumps(base.sistemas))
+            alterado = sistemas[nomes[i % len(nomes)]]
+            alterado.pop('limites')
+            antecedentes = alterado['antecedentes']
+            _, termos = antecedentes[rng.choice(list(antecedentes))]
+            _, parametros = termos[rng.choice(list(termos))]
+            parametros[-1] += 1e-6 * (i + 1)
+            caminho = os.path.join(pasta, f'variante_{i}.json')
+            motor.Modelo(sistemas, versao=f'variante-{i}').salvar(caminho, base.termos_compartilhados, limites=False)
+            caminhos.append(caminho)
+
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        modelos = [motor.carregar_modelo(c) for c in caminhos]
+        leitura = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        compilados = [m.compilado(nome) for m in modelos for nome in nomes]
+        compilacao = time.perf_counter() - inicio
+        memoria, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {'variantes': variantes,
+            'leitura_ms_por_variante': leitura / variantes * 1e3,
+            'compilacao_ms_por_variante': compilacao / variantes * 1e3,
+            'memoria_mb': memoria / 2**20,
+            'sistemas_compilados': len({id(c) for c in compilados})}
+
+
+def _metadados():
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=pasta, check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'data': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'plataforma': platform.platform(), 'nucleos': os.cpu_count()}
+
+
+def benchmark_completo(rapido=False):
+    trabalhadores = sorted({1, 2, 4, os.cpu_count() or 1})
+    return {
+        'metadados': _metadados(),
+        'metricas': {
+            'latencia': benchmark_latencia(500 if rapido else 2000),
+            'vazao': benchmark_vazao([1000, 10000] if rapido else [1000, 100000, 1000000]),
+            'memoria': benchmark_memoria(10000 if rapido else 100000),
+            'escalonamento': benchmark_escalonamento(4000 if rapido else 20000, trabalhadores),
+            'partida_a_frio_s': benchmark_importacao(3 if rapido else 5),
+            'modelos': benchmark_modelos(20 if rapido else 100),
+        },
+    }
+
+
+def _achatar(metricas, prefixo=''):
+    planas = {}
+    for chave, valor in metricas.items():
+        caminho = f'{prefixo}/{chave}' if prefixo else str(chave)
+        if isinstance(valor, dict):
+            planas.update(_achatar(valor, caminho))
+        elif isinstance(valor, (int, float)):
+            planas[caminho] = valor
+    return planas
+
+
+def comparar(base, novo, tolerancia=0.1):
+    """
+    Métricas de `novo` piores que as de `base` em mais de `tolerancia` (fração).
+    Métricas '..._por_s' são melhores quando maiores; as demais (tempo, memória), quando menores
+    """
+    antes, depois = _achatar(base['metricas']), _achatar(novo['metricas'])
+    regressoes = []
+    for caminho in sorted(antes.keys() & depois.keys()):
+        a, d = antes[caminho], depois[caminho]
+        if a <= 0:
+            continue
+        variacao = (a - d) / a if caminho.endswith('_por_s') else (d - a) / a
+        if variacao > tolerancia:
+            regressoes.append({'metrica': caminho, 'antes': a, 'depois': d, 'piora': variacao})
+    return regressoes
+
+
+def _emitir(resultado, caminho=None):
+    texto = json.dumps(resultado, indent=2)
+    if caminho:
+        with open(caminho, 'w') as arquivo:
+            arquivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='comando', required=True)
+    completo = sub.add_parser('completo', help='todas as medidas, com metadados, em JSON')
+    completo.add_argument('--saida', help='arquivo JSON (padrão: saída padrão)')
+    completo.add_argument('--rapido', action='store_true', help='lotes e repetições menores')
+    comparacao = sub.add_parser('comparar', help='regressões entre dois resultados de "completo"')
+    comparacao.add_argument('base')
+    comparacao.add_argument('novo')
+    comparacao.add_argument('--tolerancia', type=float, default=0.1, help='piora aceita (padrão: 0.1 = 10%%)')
+    latencia = sub.add_parser('latencia', help='tempo por chamada das funções escalares')
+    latencia.add_argument('--chamadas', type=int, default=2000)
+    vazao = sub.add_parser('vazao', help='fazendas/s das funções em lote')
+    vazao.add_argument('--tamanhos', type=int, nargs='+', default=[1000, 100000, 1000000])
+    memoria = sub.add_parser('memoria', help='pico de memória das funções em lote')
+    memoria.add_argument('--fazendas', type=int, default=100000)
+    concorrencia = sub.add_parser('concorrencia', help='estresse com threads e vazão por número de trabalhadores')
+    concorrencia.add_argument('--fazendas', type=int, default=20000)
+    concorrencia.add_argument('--trabalhadores', type=int, nargs='+',
+                              default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    importacao = sub.add_parser('importacao', help='tempo de partida a frio do módulo')
+    importacao.add_argument('--repeticoes', type=int, default=5)
+    modelos = sub.add_parser('modelos', help='leitura, compilação e memória de variantes do modelo')
+    modelos.add_argument('--variantes', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.comando == 'completo':
+        _emitir(benchmark_completo(args.rapido), args.saida)
+    elif args.comando == 'comparar':
+        with open(args.base) as a, open(args.novo) as b:
+            regressoes = comparar(json.load(a), json.load(b), args.tolerancia)
+        _emitir({'tolerancia': args.tolerancia, 'regressoes': regressoes})
+        return 1 if regressoes else 0
+    elif args.comando == 'latencia':
+        _emitir(benchmark_latencia(args.chamadas))
+    elif args.comando == 'vazao':
+        _emitir(benchmark_vazao(args.tamanhos))
+    elif args.comando == 'memoria':
+        _emitir(benchmark_memoria(args.fazendas))
+    elif args.comando == 'importacao':
+        _emitir(benchmark_importacao(args.repeticoes))
+    elif args.comando == 'modelos':
+        _emitir(benchmark_modelos(args.variantes))
+    else:
+        resultado = benchmark_concorrencia(args.fazendas, args.trabalhadores)
+        _emitir(resultado)
+        falhas = sum(sum(e['funcoes_escalares'].values()) + e['simuladores_skfuzzy']
+                     for e in resultado['estresse'].values())
+        return 1 if falhas else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Métricas das funções de cálculo de Fuzzy.py: chamadas, erros, histograma de latência e tempo por etapa
+(entradas, fuzzificação, regras, defuzzificação) de cada índice.
+
+Ligada por Fuzzy.ativar_instrumentacao(); desligada, as funções de cálculo não medem nada.
+As métricas podem ser lidas com resumo(), exportadas no formato texto do Prometheus com
+texto_prometheus() ou recebidas evento a evento por um callback.
+"""
+import bisect
+import threading
+
+# Limites (s) das faixas do histograma de latência; a última faixa (+Inf) é implícita
+LIMITES_LATENCIA = (50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3)
+
+
+class Instrumentacao:
+    """
+    Acumula as métricas por índice. callback(evento), se informado, recebe um dict por chamada
+    ({'tipo': 'chamada', 'indice', 'duracao_s', 'etapas', 'erro'}) e por erro
+    ({'tipo': 'erro', 'indice', 'erro', 'mensagem', 'entradas'}).
+    etapas=False dispensa os tempos por etapa (só latência total e contadores)
+    """
+
+    def __init__(self, callback=None, etapas=True, limites_latencia=LIMITES_LATENCIA):
+        self.callback = callback
+        self.etapas = etapas
+        self.limites_latencia = tuple(limites_latencia)
+        self.chamadas = {}
+        self.erros = {}
+        self.faixas = {}
+        self.soma_latencia = {}
+        self.tempo_etapas = {}
+        self._trava = threading.Lock()
+        self._local = threading.local()
+
+    def cronometro(self):
+        """
+        Função cronometro(etapa, segundos) para SistemaCompilado.avaliar; os tempos valem para a
+        chamada em andamento na thread atual (ou None se etapas=False)
+        """
+        if not self.etapas:
+            return None
+        etapas = self._local.etapas = {}
+
+        def cronometro(etapa, segundos):
+            etapas[etapa] = etapas.get(etapa, 0.0) + segundos
+        return cronometro
+
+    def registrar_chamada(self, indice, duracao, erro=False):
+        etapas = getattr(self._local, 'etapas', None) or {}
+        self._local.etapas = None
+        with self._trava:
+            self.chamadas[indice] = self.chamadas.get(indice, 0) + 1
+            faixas = self.faixas.get(indice)
+            if faixas is None:
+                faixas = self.faixas[indice] = [0] * (len(self.limites_latencia) + 1)
+            faixas[bisect.bisect_left(self.limites_latencia, duracao)] += 1
+            self.soma_latencia[indice] = self.soma_latencia.get(indice, 0.0) + duracao
+            for etapa, segundos in etapas.items():
+                chave = (indice, etapa)
+                self.tempo_etapas[chave] = self.tempo_etapas.get(chave, 0.0) + segundos
+        if self.callback is not None:
+            self.callback({'tipo': 'chamada', 'indice': indice, 'duracao_s': duracao,
+                           'etapas': etapas, 'erro': erro})
+
+    def registrar_erro(self, evento):
+        chave = (evento['indice'], evento['erro'])
+        with self._trava:
+            self.erros[chave] = self.erros.get(chave, 0) + 1
+        if self.callback is not None:
+            self.callback(evento)
+
+    def _rotulos_faixas(self):
+        return [*map(repr, self.limites_latencia), '+Inf']
+
+    def resumo(self):
+        """
+        Métricas acumuladas por índice: chamadas, erros por tipo, latência média e por faixa, tempo por etapa
+        """
+        with self._trava:
+            resultado = {}
+            for indice, chamadas in self.chamadas.items():
+                resultado[indice] = {
+                    'chamadas': chamadas,
+                    'erros': {tipo: n for (i, tipo), n in self.erros.items() if i == indice},
+                    'latencia_media_s': self.soma_latencia[indice] / chamadas,
+                    'faixas_latencia': dict(zip(self._rotulos_faixas(), self.faixas[indice])),
+                    'etapas_s': {etapa: s for (i, etapa), s in self.tempo_etapas.items() if i == indice},
+                }
+            return resultado
+
+    def texto_prometheus(self, prefixo='fuzzy'):
+        """
+        Métricas no formato de exposição em texto do Prometheus
+        """
+        with self._trava:
+            linhas = [f'# HELP {prefixo}_chamadas_total Chamadas das funções de cálculo por índice',
+                      f'# TYPE {prefixo}_chamadas_total counter']
+            linhas += [f'{prefixo}_chamadas_total{{indice="{i}"}} {n}' for i, n in sorted(self.chamadas.items())]
+
+            linhas += [f'# HELP {prefixo}_erros_total Cálculos que falharam (retornaram None), por tipo de erro',
+                       f'# TYPE {prefixo}_erros_total counter']
+            linhas += [f'{prefixo}_erros_total{{indice="{i}",erro="{tipo}"}} {n}'
+                       for (i, tipo), n in sorted(self.erros.items())]
+
+            linhas += [f'# HELP {prefixo}_latencia_segundos Duração de cada chamada',
+                       f'# TYPE {prefixo}_latencia_segundos histogram']
+            for indice, faixas in sorted(self.faixas.items()):
+                acumulado = 0
+                for limite, n in zip(self._rotulos_faixas(), faixas):
+                    acumulado += n
+                    linhas.append(f'{prefixo}_latencia_segundos_bucket{{indice="{indice}",le="{limite}"}} {acumulado}')
+                linhas.append(f'{prefixo}_latencia_segundos_sum{{indice="{indice}"}} {self.soma_latencia[indice]!r}')
+                linhas.append(f'{prefixo}_latencia_segundos_count{{indice="{indice}"}} {acumulado}')
+
+            linhas += [f'# HELP {prefixo}_etapa_segundos_total Tempo acumulado em cada etapa do cálculo',
+                       f'# TYPE {prefixo}_etapa_segundos_total counter']
+            linhas += [f'{prefixo}_etapa_segundos_total{{indice="{i}",etapa="{e}"}} {s!r}'
+                       for (i, e), s in sorted(self.tempo_etapas.items())]
+        return '\n'.join(linhas) + '\n'
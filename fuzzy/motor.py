@@ -0,0 +1,1051 @@
+import collections
+import copy
+import functools
+import hashlib
+import itertools
+import json
+import math
+import operator
+import os
+import re
+import threading
+import time
+import weakref
+
+import numpy as np
+
+# Número de fazendas avaliadas por vez: limita as matrizes (N x universo)
+TAMANHO_BLOCO = 8192
+# Limite de fazendas x pontos do universo de saída por bloco, para universos com resolução alta
+PONTOS_POR_BLOCO = 2 ** 20
+
+
+def _somente_leitura(array):
+    array = np.ascontiguousarray(array)
+    array.flags.writeable = False
+    return array
+
+
+def _marcar(cronometro, etapa, marca):
+    """
+    Informa ao cronometro o tempo desde `marca` e retorna o instante atual
+    """
+    agora = time.perf_counter()
+    cronometro(etapa, agora - marca)
+    return agora
+
+
+class SistemaCompilado:
+    """
+    Sistema de Mamdani achatado em arrays: pertinências amostradas de cada termo,
+    cláusulas das regras como listas de índices de termos e o termo consequente de cada cláusula.
+    A avaliação não percorre o grafo do skfuzzy e é vetorizada sobre N fazendas.
+    """
+
+    def __init__(self, variaveis, universos, pertinencias, clausulas, clausula_peso,
+                 inicio_termo, termos_ativos, universo_saida, pertinencias_saida, saida,
+                 trapezios_saida=None, pontos_fixos=None):
+        self.variaveis = variaveis              # rótulos dos antecedentes, na ordem das entradas
+        self.universos = universos              # universo de cada antecedente
+        self.pertinencias = pertinencias        # (termos x universo) de cada antecedente
+        self.clausulas = clausulas              # (cláusulas x K) índices na matriz de pertinências
+        self.clausula_peso = clausula_peso      # peso da regra de cada cláusula
+        self.inicio_termo = inicio_termo        # início das cláusulas de cada termo ativo (reduceat)
+        self.termos_ativos = termos_ativos      # termos do consequente que aparecem em alguma regra
+        self.universo_saida = universo_saida
+        self.pertinencias_saida = pertinencias_saida
+        self.saida = saida
+        # Centroide analítico (ver compilar_modelo): (a, b, c, d) de cada termo ativo e os pontos
+        # de quebra da saída que não dependem dos cortes. None no modo amostrado
+        self.trapezios_saida = trapezios_saida
+        self.pontos_fixos = pontos_fixos
+        self.n_termos = sum(mf.shape[0] for mf in pertinencias)
+        self._assinatura = None
+        self._limites = {}
+
+    def assinatura(self):
+        """
+        Hash das funções de pertinência e das regras; muda sempre que o sistema muda
+        """
+        if self._assinatura is None:
+            h = hashlib.sha256(repr((self.variaveis, self.saida)).encode())
+            for array in [*self.universos, *self.pertinencias, self.clausulas, self.clausula_peso,
+                          self.inicio_termo, self.termos_ativos, self.universo_saida, self.pertinencias_saida]:
+                h.update(np.ascontiguousarray(array).tobytes())
+            if self.trapezios_saida is not None:
+                h.update(b'analitico' + self.trapezios_saida.tobytes())
+            self._assinatura = h.hexdigest()[:16]
+        return self._assinatura
+
+    def pertinencia(self, rotulo, x):
+        """
+        Pertinência (N x termos) de x em cada termo da variável, recortando x ao universo
+        """
+        i = self.variaveis.index(rotulo)
+        universo = self.universos[i]
+        x = np.clip(x, universo[0], universo[-1])
+        return np.stack([np.interp(x, universo, linha) for linha in self.pertinencias[i]], axis=1)
+
+    def fuzzificar(self, entradas, pre_fuzzificadas=None):
+        """
+        Matriz (N x termos + complementos + 1) com a pertinência de cada termo,
+        recortando as entradas ao universo como o ControlSystemSimulation.
+        pre_fuzzificadas: rótulo -> pertinências (N x termos) já calculadas, usadas no lugar da entrada
+        """
+        pre = pre_fuzzificadas or {}
+        mu = np.concatenate([pre[r] if r in pre else self.pertinencia(r, entradas[r]) for r in self.variaveis],
+                            axis=1)
+        # Complementos (NÃO termo) e a coluna constante usada para completar cláusulas curtas
+        return np.concatenate([mu, 1.0 - mu, np.ones((mu.shape[0], 1))], axis=1)
+
+    def colunas(self, rotulo):
+        """
+        Colunas da variável na matriz de fuzzificar: pertinências dos termos seguidas dos complementos
+        """
+        i = self.variaveis.index(rotulo)
+        inicio = sum(mf.shape[0] for mf in self.pertinencias[:i])
+        termos = np.arange(inicio, inicio + self.pertinencias[i].shape[0])
+        return np.concatenate([termos, termos + self.n_termos])
+
+    def cortes(self, mu):
+        """
+        Nível de corte (N x termos ativos) de cada termo do consequente: máximo dos disparos das regras
+        """
+        disparo = mu[:, self.clausulas].min(axis=2) * self.clausula_peso
+        return np.maximum.reduceat(disparo, self.inicio_termo, axis=1)
+
+    def defuzzificar(self, cortes):
+        """
+        Centroide da saída agregada, equivalente ao CrispValueCalculator do skfuzzy:
+        a área é integrada exatamente sobre o universo acrescido dos pontos de corte.
+        Nos sistemas compilados com defuzzificacao='analitica', ver defuzzificar_analitico
+        """
+        if self.trapezios_saida is not None:
+            return self.defuzzificar_analitico(cortes)
+
+        universo = self.universo_saida
+        mf = self.pertinencias_saida[self.termos_ativos]
+        n, t = cortes.shape
+        c = cortes[:, :, None]
+
+        # Pontos onde cada termo cruza seu nível de corte (no máximo dois, conjuntos convexos)
+        acima = np.where(c == 0.0, mf > 0.0, mf >= c)
+        cruza = acima[:, :, 1:] != acima[:, :, :-1]
+        ultimo = cruza.shape[2] - 1
+        pontos = [universo[None, :].repeat(n, axis=0)]
+        for idx in (cruza.argmax(axis=2), ultimo - cruza[:, :, ::-1].argmax(axis=2)):
+            existe = np.take_along_axis(cruza, idx[:, :, None], axis=2)[:, :, 0]
+            y0 = mf[np.arange(t), idx]
+            y1 = mf[np.arange(t), idx + 1]
+            dy = np.where(existe, y1 - y0, 1.0)
+            x = universo[idx] + (cortes - y0) * (universo[idx + 1] - universo[idx]) / dy
+            # Sem cruzamento: repete um ponto do universo (segmento de largura zero)
+            pontos.append(np.where(existe, x, universo[0]))
+        return self._centroide(np.sort(np.concatenate(pontos, axis=1), axis=1), cortes)
+
+    def defuzzificar_analitico(self, cortes):
+        """
+        Centroide exato dos termos triangulares/trapezoidais cortados, sem amostrar o universo.
+        A saída agregada é linear entre os vértices dos termos, os cruzamentos entre lados de termos
+        diferentes (pontos_fixos) e os pontos em que cada lado atinge cada nível de corte; integrando
+        por trapézios só nesses pontos o resultado é exato
+        """
+        universo = self.universo_saida
+        a, b, c, d = (self.trapezios_saida[:, i] for i in range(4))
+        n, t = cortes.shape
+        nivel = cortes[:, None, :]
+        sobe = a[None, :, None] + nivel * (b - a)[None, :, None]
+        desce = d[None, :, None] - nivel * (d - c)[None, :, None]
+        moveis = np.clip(np.concatenate([sobe.reshape(n, -1), desce.reshape(n, -1)], axis=1),
+                         universo[0], universo[-1])
+        x = np.sort(np.concatenate([np.broadcast_to(self.pontos_fixos, (n, self.pontos_fixos.size)), moveis],
+                                   axis=1), axis=1)
+        return self._centroide(x, cortes)
+
+    def _centroide(self, x, cortes):
+        """
+        Centroide da agregação max-min avaliada nos pontos x (N x P, ordenados), integrada por trapézios
+        """
+        universo = self.universo_saida
+        mf = self.pertinencias_saida[self.termos_ativos]
+        y = np.zeros_like(x)
+        for j in range(cortes.shape[1]):
+            np.maximum(y, np.minimum(cortes[:, j:j + 1], np.interp(x, universo, mf[j])), out=y)
+
+        x1 = x[:, :-1]
+        dx = x[:, 1:] - x1
+        y1, y2 = y[:, :-1], y[:, 1:]
+        area = 0.5 * dx * (y1 + y2)
+        momento = dx * dx * (y1 + 2.0 * y2) / 6.0 + x1 * area
+        soma_area = area.sum(axis=1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            resultado = momento.sum(axis=1) / np.fmax(soma_area, np.finfo(float).eps)
+        # Nenhuma regra disparou: o skfuzzy não consegue defuzzificar
+        resultado[~(soma_area > 0)] = np.nan
+        return resultado
+
+    def avaliar(self, entradas, tamanho_bloco=TAMANHO_BLOCO, pre_fuzzificadas=None, cronometro=None):
+        """
+        Avalia o sistema para N conjuntos de entradas (dict rótulo -> array (N,) ou escalar).
+        Variáveis em pre_fuzzificadas (rótulo -> pertinências N x termos, ver pertinencia) dispensam a entrada.
+        cronometro(etapa, segundos), se informado, recebe o tempo de cada etapa: 'entradas',
+        'fuzzificacao', 'regras' e 'defuzzificacao'.
+        Retorna np.ndarray (N,) com o valor defuzzificado, NaN quando alguma entrada é NaN
+        ou nenhuma regra dispara
+        """
+        if cronometro is not None:
+            marca = time.perf_counter()
+        pre = pre_fuzzificadas or {}
+        rotulos = [r for r in self.variaveis if r not in pre]
+        faltando = [r for r in rotulos if r not in entradas]
+        if faltando:
+            raise KeyError(f"Entradas ausentes: {', '.join(faltando)}")
+
+        valores = [np.asarray(entradas[r], dtype=float).ravel() for r in rotulos]
+        n, = np.broadcast_shapes(*[v.shape for v in valores], *[np.shape(p)[:1] for p in pre.values()])
+        valores = [np.broadcast_to(v, (n,)) for v in valores]
+        resultado = np.empty(n)
+        tamanho_bloco = max(1, min(tamanho_bloco, PONTOS_POR_BLOCO // self.universo_saida.size))
+        if cronometro is not None:
+            marca = _marcar(cronometro, 'entradas', marca)
+        for inicio in range(0, n, tamanho_bloco):
+            fatia = slice(inicio, inicio + tamanho_bloco)
+            bloco = {r: v[fatia] for r, v in zip(rotulos, valores)}
+            mu = self.fuzzificar(bloco, {r: p[fatia] for r, p in pre.items()})
+            if cronometro is None:
+                resultado[fatia] = self.defuzzificar(self.cortes(mu))
+                continue
+            marca = _marcar(cronometro, 'fuzzificacao', marca)
+            cortes = self.cortes(mu)
+            marca = _marcar(cronometro, 'regras', marca)
+            resultado[fatia] = self.defuzzificar(cortes)
+            marca = _marcar(cronometro, 'defuzzificacao', marca)
+
+        invalidos = np.zeros(n, dtype=bool)
+        for v in valores:
+            invalidos |= np.isnan(v)
+        for p in pre.values():
+            invalidos |= np.isnan(p).any(axis=1)
+        resultado[invalidos] = np.nan
+        return resultado
+
+    def limites(self, dominio=None):
+        """
+        Menor e maior saída possível, usadas para levar o resultado a 0-100.
+        Avalia a grade formada, em cada variável, pelas extremidades do universo e pelos pontos onde
+        alguma pertinência muda de inclinação (vértices dos termos), onde ficam os extremos do centroide.
+        dominio: {rótulo: lista de valores permitidos ou 'inteiro'} das variáveis discretas, que só
+        entram na grade com os valores que uma fazenda pode ter (ex. plano_saude 0 ou 1)
+        """
+        dominio = dominio or {}
+        chave = json.dumps(dominio, sort_keys=True)
+        if chave not in self._limites:
+            pontos = []
+            for rotulo, universo, mf in zip(self.variaveis, self.universos, self.pertinencias):
+                inclinacao = np.diff(mf, axis=1) / np.diff(universo)
+                quebra = ~np.isclose(inclinacao[:, 1:], inclinacao[:, :-1], rtol=1e-6, atol=1e-12).all(axis=0)
+                candidatos = np.concatenate([universo[[0, -1]], universo[1:-1][quebra]])
+                valores = dominio.get(rotulo)
+                if valores == 'inteiro':
+                    # Inteiros vizinhos de cada ponto da grade contínua
+                    candidatos = np.clip(np.concatenate([np.floor(candidatos), np.ceil(candidatos)]),
+                                         np.ceil(universo[0]), np.floor(universo[-1]))
+                elif valores is not None:
+                    candidatos = np.asarray(valores, dtype=float)
+                pontos.append(np.unique(candidatos))
+            grade = itertools.product(*pontos)
+            minimo, maximo = np.inf, -np.inf
+            while True:
+                bloco = np.array(list(itertools.islice(grade, 65536)))
+                if bloco.size == 0:
+                    break
+                saida = self.avaliar(dict(zip(self.variaveis, bloco.T)))
+                minimo, maximo = min(minimo, np.nanmin(saida)), max(maximo, np.nanmax(saida))
+            self._limites[chave] = (float(minimo), float(maximo))
+        return self._limites[chave]
+
+
+def _montar(variaveis, universos, pertinencias, por_termo, universo_saida, pertinencias_saida, saida,
+           trapezios_saida=None):
+    """
+    Monta o SistemaCompilado a partir das cláusulas de cada termo do consequente
+    (por_termo[i] = lista de (índices das colunas de pertinência, peso da regra))
+    """
+    n_termos = sum(len(mf) for mf in pertinencias)
+    termos_ativos = [i for i, lista in enumerate(por_termo) if lista]
+    lista = [item for i in termos_ativos for item in por_termo[i]]
+    largura = max(len(indices) for indices, _ in lista)
+    constante = 2 * n_termos
+    clausulas = np.full((len(lista), largura), constante, dtype=np.intp)
+    for linha, (indices, _) in enumerate(lista):
+        clausulas[linha, :len(indices)] = indices
+    inicio_termo = np.cumsum([0] + [len(por_termo[i]) for i in termos_ativos[:-1]])
+
+    return SistemaCompilado(
+        variaveis=list(variaveis),
+        universos=[_somente_leitura(np.asarray(u, dtype=float)) for u in universos],
+        pertinencias=[_somente_leitura(np.asarray(mf, dtype=float)) for mf in pertinencias],
+        clausulas=_somente_leitura(clausulas),
+        clausula_peso=_somente_leitura(np.array([peso for _, peso in lista], dtype=float)),
+        inicio_termo=_somente_leitura(inicio_termo.astype(np.intp)),
+        termos_ativos=_somente_leitura(np.array(termos_ativos, dtype=np.intp)),
+        universo_saida=_somente_leitura(np.asarray(universo_saida, dtype=float)),
+        pertinencias_saida=_somente_leitura(np.asarray(pertinencias_saida, dtype=float)),
+        saida=saida,
+        trapezios_saida=None if trapezios_saida is None else _somente_leitura(trapezios_saida[termos_ativos]),
+        pontos_fixos=None if trapezios_saida is None else _somente_leitura(
+            _pontos_fixos(trapezios_saida[termos_ativos], universo_saida)),
+    )
+
+
+def trimf(x, abc):
+    """
+    Função de pertinência triangular, com a mesma amostragem de skfuzzy.trimf
+    """
+    a, b, c = (float(v) for v in abc)
+    y = np.zeros(len(x))
+    if a != b:
+        idx = (a < x) & (x < b)
+        y[idx] = (x[idx] - a) / (b - a)
+    if b != c:
+        idx = (b < x) & (x < c)
+        y[idx] = (c - x[idx]) / (c - b)
+    y[x == b] = 1
+    return y
+
+
+def trapmf(x, abcd):
+    """
+    Função de pertinência trapezoidal, com a mesma amostragem de skfuzzy.trapmf
+    """
+    a, b, c, d = (float(v) for v in abcd)
+    y = np.ones(len(x))
+    idx = x <= b
+    y[idx] = trimf(x[idx], (a, b, b))
+    idx = x >= c
+    y[idx] = trimf(x[idx], (c, c, d))
+    y[(x < a) | (x > d)] = 0
+    return y
+
+
+FUNCOES_PERTINENCIA = {'trimf': trimf, 'trapmf': trapmf}
+
+
+def clausulas_regra(expressao):
+    """
+    Lê o antecedente de uma regra escrito como 'var[termo] & var[termo] | ~var[termo]'
+    (E tem precedência sobre OU). Retorna uma lista de cláusulas E, cada uma uma lista de
+    (variável, termo, negado)
+    """
+    clausulas = []
+    for parte in expressao.split('|'):
+        clausula = []
+        for literal in parte.split('&'):
+            literal = literal.strip()
+            negado = literal.startswith('~')
+            encontrado = re.fullmatch(r'(\w+)\[([^\]]+)\]', literal.lstrip('~').strip())
+            if encontrado is None:
+                raise ValueError(f"Termo inválido na regra '{expressao}': '{literal}'")
+            clausula.append((encontrado.group(1), encontrado.group(2), negado))
+        clausulas.append(clausula)
+    return clausulas
+
+
+def _pontos_fixos(trapezios, universo):
+    """
+    Pontos de quebra da saída agregada que não dependem dos cortes: extremidades do universo,
+    vértices dos termos e cruzamentos entre lados (subida ou descida) de termos diferentes
+    """
+    inicio, fim = universo[0], universo[-1]
+    lados = []
+    for a, b, c, d in trapezios:
+        if b > a:
+            lados.append((a, 0.0, b, 1.0))
+        if d > c:
+            lados.append((c, 1.0, d, 0.0))
+    pontos = [inicio, fim, *trapezios.ravel()]
+    for (x0, y0, x1, y1), (u0, v0, u1, v1) in itertools.combinations(lados, 2):
+        m, k = (y1 - y0) / (x1 - x0), (v1 - v0) / (u1 - u0)
+        if m != k:
+            pontos.append((v0 - k * u0 - y0 + m * x0) / (m - k))
+    pontos = np.unique(np.asarray(pontos, dtype=float))
+    return pontos[(pontos >= inicio) & (pontos <= fim)]
+
+
+def _trapezio(funcao, parametros):
+    """
+    Vértices (a, b, c, d) de um termo trimf/trapmf
+    """
+    if funcao == 'trimf':
+        a, b, c = parametros
+        return a, b, b, c
+    return tuple(parametros)
+
+
+def _universo(arange, termos, defuzzificacao, resolucao):
+    """
+    Universo amostrado de uma variável: np.arange(*arange), ou o mesmo intervalo com `resolucao` pontos,
+    ou (modo analítico) só as extremidades e os vértices dos termos, onde a interpolação linear é exata
+    """
+    universo = np.arange(*arange)
+    inicio, fim = universo[0], universo[-1]
+    if defuzzificacao == 'analitica':
+        vertices = [v for funcao, parametros in termos.values() for v in _trapezio(funcao, parametros)]
+        pontos = np.unique(np.asarray([inicio, fim, *vertices], dtype=float))
+        return pontos[(pontos >= inicio) & (pontos <= fim)]
+    if resolucao:
+        return np.linspace(inicio, fim, resolucao)
+    return universo
+
+
+def compilar_modelo(modelo, defuzzificacao='amostrada', resolucao=None):
+    """
+    Compila um sistema descrito como dados, sem construir objetos do skfuzzy.
+    modelo: {'antecedentes': {rótulo: (args de np.arange, {termo: (função, parâmetros)})},
+             'consequente': (rótulo, args de np.arange, {termo: (função, parâmetros)}),
+             'regras': [(antecedente, termo do consequente), ...]}
+    defuzzificacao: 'amostrada' (igual ao skfuzzy, sobre o universo amostrado) ou 'analitica'
+    (pertinências e centroide exatos dos termos trimf/trapmf, sem depender de amostragem).
+    resolucao: no modo amostrado, número de pontos de cada universo no lugar do passo do np.arange
+    """
+    if defuzzificacao not in ('amostrada', 'analitica'):
+        raise ValueError(f"Defuzzificação desconhecida: {defuzzificacao}")
+
+    variaveis, universos, pertinencias, indice_termo = [], [], [], {}
+    for rotulo, (arange, termos) in modelo['antecedentes'].items():
+        universo = _universo(arange, termos, defuzzificacao, resolucao)
+        variaveis.append(rotulo)
+        universos.append(universo)
+        pertinencias.append([FUNCOES_PERTINENCIA[funcao](universo, parametros)
+                             for funcao, parametros in termos.values()])
+        for termo in termos:
+            indice_termo[rotulo, termo] = len(indice_termo)
+    n_termos = len(indice_termo)
+
+    saida, arange_saida, termos_saida = modelo['consequente']
+    universo_saida = _universo(arange_saida, termos_saida, defuzzificacao, resolucao)
+    nomes_saida = list(termos_saida)
+    por_termo = [[] for _ in nomes_saida]
+    for expressao, termo in modelo['regras']:
+        for clausula in clausulas_regra(expressao):
+            indices = [indice_termo[v, t] + (n_termos if negado else 0) for v, t, negado in clausula]
+            por_termo[nomes_saida.index(termo)].append((indices, 1.0))
+
+    trapezios = None
+    if defuzzificacao == 'analitica':
+        trapezios = np.array([_trapezio(f, p) for f, p in termos_saida.values()], dtype=float)
+
+    return _montar(
+        variaveis=variaveis,
+        universos=universos,
+        pertinencias=pertinencias,
+        por_termo=por_termo,
+        universo_saida=universo_saida,
+        pertinencias_saida=[FUNCOES_PERTINENCIA[f](universo_saida, p) for f, p in termos_saida.values()],
+        saida=saida,
+        trapezios_saida=trapezios,
+    )
+
+
+def construir_skfuzzy(modelo):
+    """
+    Constrói o ctrl.ControlSystem do skfuzzy equivalente ao modelo (usado como referência e nos gráficos)
+    """
+    import skfuzzy as fuzz
+    from skfuzzy import control as ctrl
+
+    funcoes = {'trimf': fuzz.trimf, 'trapmf': fuzz.trapmf}
+    variaveis = {}
+    for rotulo, (arange, termos) in modelo['antecedentes'].items():
+        variavel = ctrl.Antecedent(np.arange(*arange), rotulo)
+        for termo, (funcao, parametros) in termos.items():
+            variavel[termo] = funcoes[funcao](variavel.universe, parametros)
+        variaveis[rotulo] = variavel
+
+    saida, arange_saida, termos_saida = modelo['consequente']
+    consequente = ctrl.Consequent(np.arange(*arange_saida), saida)
+    for termo, (funcao, parametros) in termos_saida.items():
+        consequente[termo] = funcoes[funcao](consequente.universe, parametros)
+
+    regras = []
+    for expressao, termo in modelo['regras']:
+        clausulas = []
+        for clausula in clausulas_regra(expressao):
+            literais = [~variaveis[v][t] if negado else variaveis[v][t] for v, t, negado in clausula]
+            clausulas.append(functools.reduce(operator.and_, literais))
+        regras.append(ctrl.Rule(functools.reduce(operator.or_, clausulas), consequente[termo]))
+    return ctrl.ControlSystem(regras)
+
+
+# Versão do formato dos arquivos de modelo lidos por carregar_modelo
+FORMATO_MODELO = 1
+NUMERO_PARAMETROS = {'trimf': 3, 'trapmf': 4}
+# Sistemas compilados compartilhados entre modelos: variantes que só mudam um sistema
+# reaproveitam os demais. Cada Modelo guarda os que compilou (Modelo._compilados), então a
+# entrada some quando nenhum modelo vivo usa mais o sistema
+_compilados_modelos = weakref.WeakValueDictionary()
+_trava_modelos = threading.Lock()
+
+
+def _termos_para_arquivo(termos):
+    return {termo: [funcao, list(parametros)] for termo, (funcao, parametros) in termos.items()}
+
+
+def _sistema_para_arquivo(modelo, limites=True):
+    """
+    Sistema no formato do arquivo de modelo (só listas e dicts), sem descrições
+    """
+    saida, arange_saida, termos_saida = modelo['consequente']
+    sistema = {
+        'antecedentes': {rotulo: {'universo': list(arange), 'termos': _termos_para_arquivo(definicao)}
+                         for rotulo, (arange, definicao) in modelo['antecedentes'].items()},
+        'consequente': {'rotulo': saida, 'universo': list(arange_saida), 'termos': _termos_para_arquivo(termos_saida)},
+        'regras': [[expressao, termo] for expressao, termo in modelo['regras']],
+    }
+    if modelo.get('dominio'):
+        sistema['dominio'] = dict(modelo['dominio'])
+    if limites and 'limites' in modelo:
+        sistema['limites'] = list(modelo['limites'])
+    return sistema
+
+
+def hash_sistema(modelo, limites=True):
+    """
+    SHA-256 do conteúdo de um sistema (universos, termos, regras, domínio e, com limites=True,
+    os limites de normalização gravados; sem descrições)
+    """
+    texto = json.dumps(_sistema_para_arquivo(modelo, limites), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(texto.encode()).hexdigest()
+
+
+def _validar_sistema(nome, modelo):
+    """
+    Confere funções e parâmetros dos termos, os termos citados nas regras, o domínio e os limites
+    """
+    saida, _, termos_saida = modelo['consequente']
+    variaveis = dict(modelo['antecedentes'])
+    for rotulo, valores in modelo.get('dominio', {}).items():
+        if rotulo not in variaveis:
+            raise ValueError(f"{nome}: variável desconhecida no domínio: {rotulo}")
+        if valores != 'inteiro' and not (isinstance(valores, (list, tuple)) and valores):
+            raise ValueError(f"{nome}: o domínio de '{rotulo}' deve ser 'inteiro' ou uma lista de valores")
+    if 'limites' in modelo and not (len(modelo['limites']) == 2 and modelo['limites'][0] < modelo['limites'][1]):
+        raise ValueError(f"{nome}: limites inválidos: {modelo['limites']}")
+    for rotulo, (arange, termos) in [*variaveis.items(), (saida, modelo['consequente'][1:])]:
+        if len(arange) != 3:
+            raise ValueError(f"{nome}: o universo de '{rotulo}' deve ter início, fim e passo")
+        for termo, (funcao, parametros) in termos.items():
+            if funcao not in NUMERO_PARAMETROS:
+                raise ValueError(f"{nome}: função desconhecida em {rotulo}[{termo}]: {funcao}")
+            if len(parametros) != NUMERO_PARAMETROS[funcao]:
+                raise ValueError(f"{nome}: {rotulo}[{termo}] ({funcao}) precisa de "
+                                 f"{NUMERO_PARAMETROS[funcao]} parâmetros")
+    for expressao, termo in modelo['regras']:
+        if termo not in termos_saida:
+            raise ValueError(f"{nome}: termo de saída desconhecido na regra '{expressao}': {termo}")
+        for clausula in clausulas_regra(expressao):
+            for rotulo, termo_entrada, _ in clausula:
+                if termo_entrada not in variaveis.get(rotulo, (None, {}))[1]:
+                    raise ValueError(f"{nome}: termo desconhecido na regra '{expressao}': {rotulo}[{termo_entrada}]")
+
+
+class Modelo:
+    """
+    Conjunto de sistemas fuzzy descritos como dados (ver compilar_modelo), com versão e hash.
+    sistemas: {nome: modelo no formato de compilar_modelo, com as chaves opcionais 'dominio'
+    (valores possíveis das variáveis discretas, ver SistemaCompilado.limites) e 'limites'
+    (menor e maior saída no modo amostrado padrão, calculados por calcular_limites)}.
+    hash: SHA-256 do conteúdo atual de todos os sistemas (recalculado a cada consulta, então reflete
+    alterações feitas em `sistemas`); identificador ('versao+12 primeiros dígitos do hash') serve para
+    marcar caches e índices gravados com o modelo que os produziu
+    """
+
+    def __init__(self, sistemas, versao='', descricao='', descricoes=None, termos_compartilhados=None):
+        for nome, modelo in sistemas.items():
+            _validar_sistema(nome, modelo)
+        self.sistemas = sistemas
+        self.versao = versao
+        self.descricao = descricao
+        self.descricoes = descricoes or {}
+        self.termos_compartilhados = termos_compartilhados or {}
+        # Conteúdo de cada sistema para o qual os limites gravados foram calculados
+        self._limites_conferidos = {nome: hash_sistema(m, limites=False)
+                                    for nome, m in sistemas.items() if 'limites' in m}
+        # (nome, defuzzificacao, resolucao) -> (hash do sistema compilado, SistemaCompilado)
+        self._compilados = {}
+
+    @property
+    def hash(self):
+        conteudo = json.dumps({nome: hash_sistema(m) for nome, m in self.sistemas.items()}, sort_keys=True)
+        return hashlib.sha256(conteudo.encode()).hexdigest()
+
+    @property
+    def identificador(self):
+        return f"{self.versao}+{self.hash[:12]}"
+
+    def compilado(self, nome, defuzzificacao='amostrada', resolucao=None):
+        """
+        SistemaCompilado do sistema `nome`, compartilhado com outros modelos que tenham o mesmo sistema.
+        Fica guardado no Modelo; é recompilado se o sistema for alterado
+        """
+        conteudo = hash_sistema(self.sistemas[nome], limites=False)
+        guardado = self._compilados.get((nome, defuzzificacao, resolucao))
+        if guardado is not None and guardado[0] == conteudo:
+            return guardado[1]
+        chave = (conteudo, defuzzificacao, resolucao)
+        with _trava_modelos:
+            compilado = _compilados_modelos.get(chave)
+            if compilado is None:
+                compilado = _compilados_modelos[chave] = compilar_modelo(self.sistemas[nome], defuzzificacao,
+                                                                         resolucao)
+            self._compilados[(nome, defuzzificacao, resolucao)] = (conteudo, compilado)
+        return compilado
+
+    def limites(self, nome, defuzzificacao='amostrada', resolucao=None):
+        """
+        Menor e maior saída do sistema, usadas para levar o índice a 0-100: as gravadas no modelo
+        (modo amostrado padrão, sistema sem alterações desde o cálculo) ou, senão, calculadas sobre
+        o domínio do sistema e guardadas só em memória, no sistema compilado
+        """
+        modelo = self.sistemas[nome]
+        if ((defuzzificacao, resolucao) == ('amostrada', None) and 'limites' in modelo
+                and self._limites_conferidos.get(nome) == hash_sistema(modelo, limites=False)):
+            return tuple(modelo['limites'])
+        return self.compilado(nome, defuzzificacao, resolucao).limites(modelo.get('dominio'))
+
+    def calcular_limites(self):
+        """
+        Recalcula os limites gravados de todos os sistemas (modo amostrado padrão)
+        """
+        for nome, modelo in self.sistemas.items():
+            modelo.pop('limites', None)
+            modelo['limites'] = self.compilado(nome).limites(modelo.get('dominio'))
+            self._limites_conferidos[nome] = hash_sistema(modelo, limites=False)
+
+    def salvar(self, caminho, termos_compartilhados=None, limites=True):
+        """
+        Grava o modelo em JSON, com o hash do conteúdo atual. termos_compartilhados: {nome: termos}; variáveis
+        com exatamente esses termos gravam só o nome (ex. os quatro termos dos índices 0-100, repetidos em
+        vários sistemas); por padrão, os do arquivo de onde o modelo foi lido.
+        limites=True recalcula os limites de normalização antes de gravar (alguns segundos); com
+        limites=False só são gravados os que ainda correspondem ao sistema
+        """
+        if limites:
+            self.calcular_limites()
+        for nome, modelo in self.sistemas.items():
+            if self._limites_conferidos.get(nome) != hash_sistema(modelo, limites=False):
+                modelo.pop('limites', None)
+        if termos_compartilhados is None:
+            termos_compartilhados = self.termos_compartilhados
+        termos_compartilhados = {nome: _termos_para_arquivo(termos) for nome, termos in termos_compartilhados.items()}
+        sistemas = {}
+        for nome, modelo in self.sistemas.items():
+            sistema = _sistema_para_arquivo(modelo)
+            for variavel in [*sistema['antecedentes'].values(), sistema['consequente']]:
+                variavel['termos'] = next((c for c, t in termos_compartilhados.items() if t == variavel['termos']),
+                                          variavel['termos'])
+            for rotulo, descricao in self.descricoes.get(nome, {}).items():
+                sistema['antecedentes'][rotulo] = {'descricao': descricao, **sistema['antecedentes'][rotulo]}
+            sistemas[nome] = sistema
+        dados = {'formato': FORMATO_MODELO, 'versao': self.versao, 'descricao': self.descricao,
+                 'hash': self.hash, 'termos': termos_compartilhados, 'sistemas': sistemas}
+        temporario = caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(_json_compacto(dados) + '\n')
+        os.replace(temporario, caminho)
+
+
+def _json_compacto(valor, recuo=''):
+    """
+    JSON legível e curto: dicts um item por linha, listas numa linha só quando cabem (termos, regras)
+    """
+    if isinstance(valor, dict) and valor:
+        itens = [f'{recuo}  {json.dumps(k, ensure_ascii=False)}: {_json_compacto(v, recuo + "  ")}'
+                 for k, v in valor.items()]
+        return '{\n' + ',\n'.join(itens) + f'\n{recuo}}}'
+    texto = json.dumps(valor, ensure_ascii=False)
+    if isinstance(valor, list) and len(texto) > 100:
+        itens = [f'{recuo}  {_json_compacto(v, recuo + "  ")}' for v in valor]
+        return '[\n' + ',\n'.join(itens) + f'\n{recuo}]'
+    return texto
+
+
+@functools.lru_cache(maxsize=16)
+def _ler_modelo(caminho, modificado, verificar_hash):
+    with open(caminho, encoding='utf-8') as arquivo:
+        dados = json.load(arquivo)
+    if dados.get('formato') != FORMATO_MODELO:
+        raise ValueError(f"{caminho}: formato de modelo não suportado: {dados.get('formato')}")
+    compartilhados = dados.get('termos', {})
+
+    def termos(definicao):
+        if isinstance(definicao, str):
+            definicao = compartilhados[definicao]
+        return {termo: (funcao, parametros) for termo, (funcao, parametros) in definicao.items()}
+
+    sistemas, descricoes = {}, {}
+    for nome, sistema in dados['sistemas'].items():
+        consequente = sistema['consequente']
+        sistemas[nome] = {
+            'antecedentes': {rotulo: (tuple(v['universo']), termos(v['termos']))
+                             for rotulo, v in sistema['antecedentes'].items()},
+            'consequente': (consequente['rotulo'], tuple(consequente['universo']), termos(consequente['termos'])),
+            'regras': [tuple(regra) for regra in sistema['regras']],
+        }
+        for chave in ('dominio', 'limites'):
+            if chave in sistema:
+                sistemas[nome][chave] = sistema[chave]
+        descricoes[nome] = {rotulo: v['descricao'] for rotulo, v in sistema['antecedentes'].items() if 'descricao' in v}
+    modelo = Modelo(sistemas, dados.get('versao', ''), dados.get('descricao', ''), descricoes,
+                    {nome: termos(definicao) for nome, definicao in compartilhados.items()})
+    if verificar_hash and dados.get('hash') not in (None, modelo.hash):
+        raise ValueError(f"{caminho}: o hash gravado não confere com o conteúdo (o modelo foi editado "
+                         f"sem atualizar o campo 'hash'?)")
+    return modelo
+
+
+def carregar_modelo(caminho, verificar_hash=True):
+    """
+    Lê um modelo gravado por Modelo.salvar (JSON com formato, versao, hash, termos compartilhados e
+    sistemas). Não importa o skfuzzy; os sistemas são compilados sob demanda por Modelo.compilado.
+    Cada arquivo é lido uma vez (enquanto não for modificado; os 16 lidos por último ficam em memória);
+    cada chamada devolve uma cópia própria, então alterar os sistemas do Modelo devolvido não afeta
+    as outras nem o arquivo.
+    Um arquivo editado à mão tem o hash conferido com o conteúdo; para atualizá-lo:
+    carregar_modelo(caminho, verificar_hash=False).salvar(caminho)
+    """
+    caminho = os.path.abspath(caminho)
+    return copy.deepcopy(_ler_modelo(caminho, os.stat(caminho).st_mtime_ns, verificar_hash))
+
+
+class Encadeamento:
+    """
+    Sistemas cujas saídas, levadas a 0-100, são as entradas de um sistema final (os índices social,
+    econômico e ambiental alimentando a sustentabilidade), avaliados juntos, bloco a bloco.
+    etapas: {nome: SistemaCompilado}, com os nomes das entradas do sistema final;
+    limites: {nome: (mínimo, máximo)} de cada etapa e do final, usados na normalização
+    """
+
+    def __init__(self, etapas, final, limites):
+        self.etapas = etapas
+        self.final = final
+        self.limites = limites
+        self.variaveis = list(dict.fromkeys(r for c in etapas.values() for r in c.variaveis))
+        # Colunas de cada variável (etapas e final) na matriz de pertinências devolvida por avaliar
+        self.colunas = {}
+        inicio = 0
+        for compilado in [*etapas.values(), final]:
+            for rotulo, mf in zip(compilado.variaveis, compilado.pertinencias):
+                self.colunas[rotulo] = slice(inicio, inicio + mf.shape[0])
+                inicio += mf.shape[0]
+        self.n_termos = inicio
+
+    def _etapa(self, compilado, entradas, limites, saida, graus):
+        """
+        Avalia um bloco de um sistema gravando a saída normalizada em `saida` (e as pertinências em `graus`)
+        """
+        mu = compilado.fuzzificar(entradas)
+        if graus is not None:
+            inicio = self.colunas[compilado.variaveis[0]].start
+            graus[:, inicio:inicio + compilado.n_termos] = mu[:, :compilado.n_termos]
+        saida[:] = compilado.defuzzificar(compilado.cortes(mu))
+        for x in entradas.values():
+            saida[np.isnan(x)] = np.nan
+        minimo, maximo = limites
+        np.subtract(saida, minimo, out=saida)
+        np.multiply(saida, 100, out=saida)
+        np.divide(saida, maximo - minimo, out=saida)
+
+    def avaliar(self, entradas, tamanho_bloco=TAMANHO_BLOCO, pertinencias=True):
+        """
+        Avalia N fazendas (dict rótulo -> array (N,) ou escalar, com as variáveis de todas as etapas).
+        As saídas são alocadas uma vez e preenchidas bloco a bloco, então a memória de trabalho
+        não cresce com N. Retorna ({nome da etapa ou do final: índices (N,)}, pertinências N x n_termos
+        nas colunas de self.colunas, ou None se pertinencias=False).
+        Entradas NaN dão NaN nos índices que dependem delas
+        """
+        faltando = [r for r in self.variaveis if r not in entradas]
+        if faltando:
+            raise KeyError(f"Entradas ausentes: {', '.join(faltando)}")
+        valores = {r: np.asarray(entradas[r], dtype=float).ravel() for r in self.variaveis}
+        n, = np.broadcast_shapes(*[v.shape for v in valores.values()])
+        valores = {r: np.broadcast_to(v, (n,)) for r, v in valores.items()}
+
+        indices = {nome: np.empty(n) for nome in [*self.etapas, self.final.saida]}
+        graus = np.empty((n, self.n_termos)) if pertinencias else None
+        universo = max(c.universo_saida.size for c in [*self.etapas.values(), self.final])
+        tamanho_bloco = max(1, min(tamanho_bloco, PONTOS_POR_BLOCO // universo))
+        for inicio in range(0, n, tamanho_bloco):
+            fatia = slice(inicio, inicio + tamanho_bloco)
+            bloco_graus = None if graus is None else graus[fatia]
+            for nome, compilado in self.etapas.items():
+                self._etapa(compilado, {r: valores[r][fatia] for r in compilado.variaveis},
+                            self.limites[nome], indices[nome][fatia], bloco_graus)
+            # Índices fora de 0-100 não são entradas válidas do sistema final
+            entradas_final = {}
+            for nome in self.final.variaveis:
+                x = indices[nome][fatia]
+                entradas_final[nome] = np.where((x < 0) | (x > 100), np.nan, x)
+            self._etapa(self.final, entradas_final, self.limites[self.final.saida],
+                        indices[self.final.saida][fatia], bloco_graus)
+        return indices, graus
+
+
+class Cenarios:
+    """
+    Uma fazenda de referência de um SistemaCompilado, fuzzificada uma única vez, para avaliar
+    variações de uma ou duas variáveis (análise de sensibilidade / "e se").
+    Em cada variação só as pertinências das variáveis alteradas são recalculadas e só as cláusulas
+    que as usam são reavaliadas; as demais reaproveitam os disparos da fazenda de referência
+    """
+
+    def __init__(self, compilado, base):
+        self.compilado = compilado
+        self.base = {r: float(base[r]) for r in compilado.variaveis}
+        self.mu = compilado.fuzzificar({r: np.array([v]) for r, v in self.base.items()})
+        self.disparo = compilado.clausula_peso * self.mu[0, compilado.clausulas].min(axis=1)
+        self.invalida = any(np.isnan(v) for v in self.base.values())
+        self.resultado = np.nan if self.invalida else compilado.defuzzificar(compilado.cortes(self.mu))[0]
+
+    def cortes(self, alteracoes):
+        """
+        Níveis de corte (S x termos ativos) com as variáveis de `alteracoes` (rótulo -> valores,
+        combinados por broadcast em S cenários) no lugar das da referência.
+        Retorna também a máscara (S,) dos cenários inválidos (NaN)
+        """
+        c = self.compilado
+        valores = np.broadcast_arrays(*[np.asarray(v, dtype=float).ravel() for v in alteracoes.values()])
+        n = valores[0].size
+        colunas = np.concatenate([c.colunas(r) for r in alteracoes])
+        afetadas = np.isin(c.clausulas, colunas).any(axis=1)
+
+        mu = np.repeat(self.mu, n, axis=0)
+        for rotulo, x in zip(alteracoes, valores):
+            pertinencia = c.pertinencia(rotulo, x)
+            mu[:, c.colunas(rotulo)] = np.concatenate([pertinencia, 1.0 - pertinencia], axis=1)
+        disparo = np.repeat(self.disparo[None, :], n, axis=0)
+        disparo[:, afetadas] = c.clausula_peso[afetadas] * mu[:, c.clausulas[afetadas]].min(axis=2)
+
+        invalidos = np.zeros(n, dtype=bool)
+        for x in valores:
+            invalidos |= np.isnan(x)
+        inalteradas = [r for r in c.variaveis if r not in alteracoes]
+        if any(np.isnan(self.base[r]) for r in inalteradas):
+            invalidos[:] = True
+        return np.maximum.reduceat(disparo, c.inicio_termo, axis=1), invalidos
+
+    def avaliar(self, grupos):
+        """
+        Avalia vários grupos de cenários (lista de dicts rótulo -> valores, como em cortes) com uma
+        única defuzzificação. Cenários com os mesmos níveis de corte (comum numa varredura, nos trechos
+        em que as pertinências não mudam) são defuzzificados uma vez só.
+        Retorna np.ndarray com os resultados de todos os grupos, em ordem
+        """
+        partes = [self.cortes(alteracoes) for alteracoes in grupos]
+        if not partes:
+            return np.empty(0)
+        cortes = np.concatenate([p[0] for p in partes])
+        invalidos = np.concatenate([p[1] for p in partes])
+        distintos, indices = np.unique(np.where(invalidos[:, None], 0.0, cortes), axis=0, return_inverse=True)
+        resultado = self.compilado.defuzzificar(distintos)[indices.ravel()]
+        resultado[invalidos] = np.nan
+        return resultado
+
+
+def diretorio_cache():
+    """
+    Diretório padrão das tabelas do modo LUT: FUZZY_CACHE ou, senão, fuzzy/ no cache do usuário
+    (XDG_CACHE_HOME ou ~/.cache), fora do pacote, que pode estar instalado sem permissão de escrita
+    """
+    if os.environ.get('FUZZY_CACHE'):
+        return os.environ['FUZZY_CACHE']
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'fuzzy')
+
+
+class TabelaConsulta:
+    """
+    Saída de um SistemaCompilado pré-calculada numa grade regular e consultada por interpolação multilinear
+    (trilinear para os 3 índices da sustentabilidade).
+    A grade é salva em .npy dentro de `diretorio` (padrão: diretorio_cache()) e aberta com memory-map;
+    o nome do arquivo leva a assinatura do sistema, então qualquer mudança nas pertinências ou regras gera
+    uma nova tabela. Se o diretório não aceitar escrita, a tabela é construída só em memória.
+    erro_maximo: maior erro medido da interpolação, na unidade da saída do sistema;
+    erro_maximo_indice: o mesmo erro na escala 0-100 do índice, quando `limites` (menor e maior saída
+    usadas na normalização) é informado
+    """
+
+    def __init__(self, compilado, resolucao=101, diretorio=None, pontos_verificacao=20000, limites=None):
+        if resolucao < 2:
+            raise ValueError("A resolução da tabela deve ser de pelo menos 2 pontos por variável")
+        self.compilado = compilado
+        self.saida = compilado.saida
+        self.resolucao = resolucao
+        self.grades = [np.linspace(u[0], u[-1], resolucao) for u in compilado.universos]
+        self.diretorio = diretorio or diretorio_cache()
+        nome = f"{compilado.saida}_{resolucao}_{compilado.assinatura()}"
+        self.caminho = os.path.join(self.diretorio, nome + '.npy')
+        self.caminho_info = os.path.join(self.diretorio, nome + '.json')
+        self._preparar_interpolacao()
+        self._assinatura = f"{compilado.assinatura()}-lut{resolucao}"
+
+        if os.path.exists(self.caminho) and os.path.exists(self.caminho_info):
+            with open(self.caminho_info) as arquivo:
+                info = json.load(arquivo)
+            self.tabela = np.load(self.caminho, mmap_mode='r')
+        else:
+            info = self._construir(pontos_verificacao)
+        self.erro_maximo = info['erro_maximo']
+        self.erro_maximo_indice = None if limites is None else self.erro_maximo * 100 / (limites[1] - limites[0])
+
+    def assinatura(self):
+        return self._assinatura
+
+    def _preparar_interpolacao(self):
+        d = len(self.grades)
+        self._inicio = np.array([g[0] for g in self.grades])
+        self._fim = np.array([g[-1] for g in self.grades])
+        self._passo = np.array([g[1] - g[0] for g in self.grades])
+        self._estrides = self.resolucao ** np.arange(d - 1, -1, -1)
+        self._cantos = np.array(list(itertools.product((0, 1), repeat=d)), dtype=bool)
+        self._deslocamentos = self._cantos @ self._estrides
+
+    def _construir(self, pontos_verificacao):
+        """
+        Avalia o sistema em todos os pontos da grade (uma fatia da primeira variável por vez),
+        mede o maior erro da interpolação contra o resultado exato e grava a tabela, se possível.
+        Retorna as informações da tabela (erro_maximo, ...)
+        """
+        forma = (self.resolucao,) * len(self.grades)
+        temporario = f"{self.caminho}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.diretorio, exist_ok=True)
+            tabela = np.lib.format.open_memmap(temporario, mode='w+', dtype=np.float64, shape=forma)
+        except OSError:
+            temporario = None
+            tabela = np.empty(forma)
+        for i, x in enumerate(self.grades[0]):
+            malha = np.meshgrid(*self.grades[1:], indexing='ij')
+            entradas = {self.compilado.variaveis[0]: np.full(malha[0].size, x)}
+            entradas.update({r: m.ravel() for r, m in zip(self.compilado.variaveis[1:], malha)})
+            tabela[i] = self.compilado.avaliar(entradas).reshape(forma[1:])
+        self.tabela = tabela
+
+        # Pontos aleatórios e centros de célula, onde o erro da interpolação costuma ser maior
+        rng = np.random.default_rng(0)
+        passo = [g[1] - g[0] for g in self.grades]
+        amostra = {}
+        for r, g, p in zip(self.compilado.variaveis, self.grades, passo):
+            aleatorios = rng.uniform(g[0], g[-1], pontos_verificacao)
+            centros = g[rng.integers(0, self.resolucao - 1, pontos_verificacao)] + p / 2
+            amostra[r] = np.concatenate([aleatorios, centros])
+        erro = np.abs(self.avaliar(amostra) - self.compilado.avaliar(amostra))
+        info = {'saida': self.compilado.saida, 'resolucao': self.resolucao,
+                'assinatura': self.compilado.assinatura(),
+                'erro_maximo': float(np.nanmax(erro)), 'pontos_verificados': int(erro.size)}
+
+        if temporario is None:
+            return info
+        tabela.flush()
+        del tabela
+        os.replace(temporario, self.caminho)
+        with open(temporario, 'w') as arquivo:
+            json.dump(info, arquivo)
+        os.replace(temporario, self.caminho_info)
+        self.tabela = np.load(self.caminho, mmap_mode='r')
+        return info
+
+    def avaliar(self, entradas, cronometro=None):
+        """
+        Mesma interface de SistemaCompilado.avaliar, com o valor interpolado para N conjuntos de entradas.
+        Entradas são recortadas ao universo; NaN em qualquer entrada resulta em NaN.
+        cronometro(etapa, segundos) recebe as etapas 'entradas' e 'interpolacao'
+        """
+        if cronometro is not None:
+            marca = time.perf_counter()
+        valores = np.broadcast_arrays(*[np.asarray(entradas[r], dtype=float).ravel()
+                                        for r in self.compilado.variaveis])
+        x = np.stack(valores, axis=1)
+        if cronometro is not None:
+            marca = _marcar(cronometro, 'entradas', marca)
+        invalidos = np.isnan(x).any(axis=1)
+        posicao = (np.clip(np.where(np.isnan(x), self._inicio, x), self._inicio, self._fim) - self._inicio) / self._passo
+        i = np.minimum(posicao.astype(np.intp), self.resolucao - 2)
+        f = (posicao - i)[:, None, :]
+
+        # Os 2^d vértices da célula: índice linear na tabela e peso de cada um
+        vertices = self.tabela.reshape(-1)[(i @ self._estrides)[:, None] + self._deslocamentos]
+        pesos = np.where(self._cantos, f, 1.0 - f).prod(axis=2)
+        resultado = (pesos * vertices).sum(axis=1)
+        resultado[invalidos] = np.nan
+        if cronometro is not None:
+            _marcar(cronometro, 'interpolacao', marca)
+        return resultado
+
+
+class CacheLRU:
+    """
+    Cache LRU limitado dos resultados de um sistema para uma fazenda por vez.
+    As entradas podem ser quantizadas por variável (quantizacao={'JA': 0.01, 'P': 10}): o cálculo é feito
+    sobre o valor quantizado, então entradas do mesmo degrau compartilham o resultado.
+    O cache se esvazia sozinho quando a assinatura do sistema muda (pertinências ou regras alteradas).
+    """
+
+    def __init__(self, variaveis, tamanho=4096, quantizacao=None):
+        if tamanho < 1:
+            raise ValueError("O tamanho do cache deve ser de pelo menos 1 resultado")
+        quantizacao = quantizacao or {}
+        self.variaveis = list(variaveis)
+        self.passos = [quantizacao.get(v) for v in self.variaveis]
+        self.tamanho = tamanho
+        self.assinatura = None
+        self.acertos = self.falhas = self.descartes = self.invalidacoes = 0
+        self._dados = collections.OrderedDict()
+        self._trava = threading.Lock()
+
+    def quantizar(self, entradas):
+        valores = {}
+        for variavel, passo in zip(self.variaveis, self.passos):
+            x = float(entradas[variavel])
+            valores[variavel] = round(x / passo) * passo if passo and math.isfinite(x) else x
+        return valores
+
+    def consultar(self, sistema, entradas, calcular):
+        """
+        Resultado de calcular(entradas quantizadas), reaproveitado se já estiver no cache
+        """
+        valores = self.quantizar(entradas)
+        chave = tuple(valores.values())
+        if any(math.isnan(x) for x in chave):
+            return calcular(valores)
+
+        assinatura = sistema.assinatura()
+        with self._trava:
+            if assinatura != self.assinatura:
+                if self._dados:
+                    self.invalidacoes += 1
+                self._dados.clear()
+                self.assinatura = assinatura
+            if chave in self._dados:
+                self._dados.move_to_end(chave)
+                self.acertos += 1
+                return self._dados[chave]
+            self.falhas += 1
+
+        resultado = calcular(valores)
+        with self._trava:
+            if assinatura == self.assinatura:
+                self._dados[chave] = resultado
+                if len(self._dados) > self.tamanho:
+                    self._dados.popitem(last=False)
+                    self.descartes += 1
+        return resultado
+
+    def limpar(self):
+        with self._trava:
+            self._dados.clear()
+
+    def estatisticas(self):
+        with self._trava:
+            return {'acertos': self.acertos, 'falhas': self.falhas, 'descartes': self.descartes,
+                    'invalidacoes': self.invalidacoes, 'itens': len(self._dados), 'tamanho': self.tamanho}
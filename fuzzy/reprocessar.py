@@ -0,0 +1,204 @@
+"""
+Recalcula os índices de sustentabilidade de uma exportação da tabela sustainability_parameters.
+
+Uso (a partir da pasta fuzzy/):
+    python reprocessar.py parametros.csv indices.csv [--bloco 50000] [--processos 8] [--retomar]
+    python reprocessar.py parametros.parquet indices_parquet/ [--retomar] [--modelo variante.json]
+
+A entrada (CSV ou Parquet) é lida em blocos de `--bloco` linhas, e cada bloco é calculado num
+processo do pool com Fuzzy.pontuar_fazendas (os quatro índices numa só passada). Há no máximo
+2 blocos por processo em andamento, então a memória não cresce com o tamanho do arquivo. Os resultados são gravados na
+ordem da entrada, bloco a bloco: no CSV de saída (anexando) ou, se a saída não terminar em .csv,
+num diretório com um arquivo Parquet por bloco.
+
+Depois de cada bloco gravado, o progresso vai para <saida>.progresso.json. Com --retomar, o
+processamento continua da primeira linha ainda não gravada.
+
+Cada linha da saída leva na coluna `modelo` o identificador (versão+hash) do modelo fuzzy que a
+calculou; --modelo usa outro arquivo de modelo no lugar de fuzzy/modelo.json. Não é possível
+retomar com um modelo diferente do usado nas linhas já gravadas.
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Colunas de sustainability_parameters (docs/add-sustainability-indices.sql) -> variáveis de Fuzzy.py
+COLUNAS = {
+    'fv_valor': 'FV',
+    'wi_valor': 'WI',
+    'p_valor': 'P',
+    'dl_valor': 'DL',
+    'anos_estudo': 'Anos_de_estudo',
+    'ja_valor': 'JA',
+    'tc_valor': 'TC',
+    'jq_valor': 'JQ',
+    'plano_saude': 'plano_saude',
+    'compartilha_lucros': 'compartilha_lucros',
+    'fo_valor': 'FO',
+    'escoamento_valor': 'Escoamento',
+    'consumo_area_valor': 'consumo_area',
+}
+BOOLEANAS = {'plano_saude', 'compartilha_lucros'}
+# Colunas de identificação copiadas para a saída, quando existirem na entrada
+IDENTIFICACAO = ['id', 'form_id']
+INDICES = ['indice_economico', 'indice_social', 'indice_ambiental', 'indice_sustentabilidade']
+
+
+def _booleano(serie):
+    """
+    Converte a coluna BOOLEAN exportada (true/false, t/f, 1/0 ou bool) em 1.0/0.0, NaN se vazia
+    """
+    texto = serie.astype(str).str.strip().str.lower()
+    valores = np.full(len(serie), np.nan)
+    valores[texto.isin(['true', 't', '1', '1.0', 'sim']).to_numpy()] = 1.0
+    valores[texto.isin(['false', 'f', '0', '0.0', 'nao', 'não']).to_numpy()] = 0.0
+    return valores
+
+
+def pontuar_bloco(bloco):
+    """
+    Calcula os quatro índices de um bloco (DataFrame com as colunas de sustainability_parameters).
+    Linhas com dados faltando ficam com NaN nos índices que dependem deles
+    """
+    import pandas as pd
+    import Fuzzy
+
+    entradas = {}
+    for coluna, variavel in COLUNAS.items():
+        if coluna in BOOLEANAS:
+            entradas[variavel] = _booleano(bloco[coluna])
+        else:
+            entradas[variavel] = pd.to_numeric(bloco[coluna], errors='coerce').to_numpy(dtype=float)
+
+    indices = Fuzzy.pontuar_fazendas(entradas, pertinencias=False)['indices']
+
+    resultado = bloco[[c for c in IDENTIFICACAO if c in bloco.columns]].reset_index(drop=True)
+    for nome in INDICES:
+        resultado[nome] = indices[nome.removeprefix('indice_')]
+    resultado['modelo'] = Fuzzy.modelo_atual().identificador
+    return resultado
+
+
+def ler_blocos(caminho, tamanho_bloco, pular=0):
+    """
+    Gera DataFrames de até tamanho_bloco linhas, ignorando as `pular` primeiras linhas de dados
+    """
+    if caminho.endswith('.csv'):
+        import pandas as pd
+        yield from pd.read_csv(caminho, chunksize=tamanho_bloco, skiprows=range(1, pular + 1), dtype=str)
+        return
+
+    import pyarrow.parquet as pq
+    for lote in pq.ParquetFile(caminho).iter_batches(batch_size=tamanho_bloco):
+        if pular >= lote.num_rows:
+            pular -= lote.num_rows
+            continue
+        yield lote.slice(pular).to_pandas()
+        pular = 0
+
+
+class Saida:
+    """
+    Grava os blocos calculados, em ordem, e o arquivo de progresso usado para retomar
+    """
+
+    def __init__(self, caminho, retomar, modelo):
+        self.caminho = caminho
+        self.caminho_progresso = caminho.rstrip('/') + '.progresso.json'
+        self.csv = caminho.endswith('.csv')
+        self.progresso = {'linhas': 0, 'blocos': 0, 'bytes': 0, 'modelo': modelo}
+
+        if retomar and os.path.exists(self.caminho_progresso):
+            with open(self.caminho_progresso) as arquivo:
+                self.progresso = json.load(arquivo)
+            if self.progresso.setdefault('modelo', modelo) != modelo:
+                raise ValueError(f"As linhas já gravadas usaram o modelo {self.progresso['modelo']}, "
+                                 f"e o atual é {modelo}; reprocesse sem --retomar")
+            if self.csv and os.path.exists(caminho):
+                # Descarta o que foi escrito depois do último bloco confirmado
+                with open(caminho, 'r+b') as arquivo:
+                    arquivo.truncate(self.progresso['bytes'])
+        elif self.csv:
+            open(caminho, 'w').close()
+        else:
+            os.makedirs(caminho, exist_ok=True)
+
+    def gravar(self, resultado):
+        if self.csv:
+            with open(self.caminho, 'a', newline='') as arquivo:
+                resultado.to_csv(arquivo, header=self.progresso['bytes'] == 0, index=False)
+                arquivo.flush()
+                os.fsync(arquivo.fileno())
+                self.progresso['bytes'] = arquivo.tell()
+        else:
+            parte = os.path.join(self.caminho, f"parte-{self.progresso['blocos']:06d}.parquet")
+            resultado.to_parquet(parte + '.tmp', index=False)
+            os.replace(parte + '.tmp', parte)
+        self.progresso['linhas'] += len(resultado)
+        self.progresso['blocos'] += 1
+
+        temporario = self.caminho_progresso + '.tmp'
+        with open(temporario, 'w') as arquivo:
+            json.dump(self.progresso, arquivo)
+        os.replace(temporario, self.caminho_progresso)
+
+
+def reprocessar(entrada, saida, tamanho_bloco=50000, processos=None, retomar=False, relatorio=sys.stderr):
+    """
+    Recalcula todos os índices de `entrada` gravando em `saida`. Retorna o total de linhas gravadas
+    """
+    import Fuzzy
+
+    destino = Saida(saida, retomar, Fuzzy.modelo_atual().identificador)
+    ja_feitas = destino.progresso['linhas']
+    if ja_feitas:
+        print(f"Retomando após {ja_feitas} linhas já gravadas", file=relatorio)
+
+    processos = processos or os.cpu_count() or 1
+    inicio = time.perf_counter()
+    pendentes = collections.deque()
+
+    def gravar_primeiro():
+        destino.gravar(pendentes.popleft().result())
+        feitas = destino.progresso['linhas'] - ja_feitas
+        decorrido = time.perf_counter() - inicio
+        print(f"{destino.progresso['linhas']} linhas gravadas | {feitas / decorrido:,.0f} linhas/s | "
+              f"{decorrido:.1f} s", file=relatorio, flush=True)
+
+    with ProcessPoolExecutor(processos) as executor:
+        for bloco in ler_blocos(entrada, tamanho_bloco, pular=ja_feitas):
+            pendentes.append(executor.submit(pontuar_bloco, bloco))
+            # Limita os blocos em memória; grava sempre na ordem de leitura
+            while len(pendentes) >= 2 * processos or (pendentes and pendentes[0].done()):
+                gravar_primeiro()
+        while pendentes:
+            gravar_primeiro()
+    return destino.progresso['linhas']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('entrada', help='exportação de sustainability_parameters (.csv ou .parquet)')
+    parser.add_argument('saida', help='arquivo .csv ou diretório para os arquivos Parquet')
+    parser.add_argument('--bloco', type=int, default=50000, help='linhas por bloco (padrão: 50000)')
+    parser.add_argument('--processos', type=int, default=None, help='processos no pool (padrão: núcleos da máquina)')
+    parser.add_argument('--retomar', action='store_true', help='continua de onde o último processamento parou')
+    parser.add_argument('--modelo', help='arquivo de modelo fuzzy (padrão: fuzzy/modelo.json)')
+    args = parser.parse_args(argv)
+    if args.modelo:
+        # Lido pelo Fuzzy.py deste processo e dos processos do pool
+        os.environ['FUZZY_MODELO'] = os.path.abspath(args.modelo)
+
+    total = reprocessar(args.entrada, args.saida, args.bloco, args.processos, args.retomar)
+    print(f"Concluído: {total} linhas", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""
+Serviço HTTP local que calcula os quatro índices com o Mamdani do Fuzzy.py (asyncio, só biblioteca padrão).
+
+Uso (a partir da pasta fuzzy/):
+    python servico.py servir [--host 127.0.0.1] [--porta 8080] [--janela-ms 5] [--lote-maximo 1024] [--processos N]
+    python servico.py carga [--url http://127.0.0.1:8080] [--requisicoes 5000] [--concorrencia 64]
+
+POST /indices recebe o JSON de uma fazenda com as variáveis de Fuzzy.py (Anos_de_estudo, plano_saude,
+compartilha_lucros, JA, TC, JQ, DL, FV, P, WI, Escoamento, FO, consumo_area) e retorna
+{"economico": ..., "social": ..., "ambiental": ..., "sustentabilidade": ...} (null onde a função escalar
+retornaria None). No lugar de Escoamento, FO e consumo_area podem vir os dados do cadastro
+(estado, area_total, area_produtiva, consumo_combustivel).
+GET /estatisticas retorna os contadores do serviço (requisições, lotes, tamanho médio do lote)
+e o identificador do modelo fuzzy em uso (FUZZY_MODELO escolhe outro arquivo de modelo).
+
+As requisições que chegam dentro de uma janela curta (--janela-ms) são juntadas num lote e calculadas
+de uma vez com Fuzzy.pontuar_fazendas, num pool de processos; o laço de eventos só recebe e responde.
+carga: gerador de carga local (fazendas sintéticas, conexões keep-alive); sem --url, sobe o serviço
+no próprio processo. Imprime latência (p50/p95/p99) e vazão em JSON e confere as respostas com o
+cálculo em lote.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import Fuzzy
+from Fuzzy import CAMPOS_FAZENDA, ENTRADAS, INDICES
+
+# Variáveis do sistema ambiental; podem vir no lugar delas os dados do cadastro, CAMPOS_FAZENDA
+# (ver Fuzzy.variaveis_ambientais)
+AMBIENTAIS = list(Fuzzy.SISTEMAS['ambiental']['antecedentes'])
+TAMANHO_MAXIMO_CORPO = 1 << 20
+
+
+def validar_fazenda(fazenda):
+    """
+    Confere o JSON de uma fazenda; retorna a mensagem de erro ou None
+    """
+    if not isinstance(fazenda, dict):
+        return "O corpo deve ser um objeto JSON com as variáveis da fazenda"
+    exigidas = ENTRADAS
+    ambientais = [v for v in AMBIENTAIS if v in fazenda]
+    if len(ambientais) < len(AMBIENTAIS) and all(c in fazenda for c in CAMPOS_FAZENDA):
+        if ambientais:
+            # Os valores enviados seriam descartados em favor dos calculados a partir do cadastro
+            return (f"Envie {', '.join(AMBIENTAIS)} completos ou só os dados do cadastro "
+                    f"({', '.join(CAMPOS_FAZENDA)}); recebido também {', '.join(ambientais)}")
+        exigidas = [v for v in ENTRADAS if v not in AMBIENTAIS] + CAMPOS_FAZENDA[1:]
+    faltando = [v for v in exigidas if v not in fazenda]
+    if faltando:
+        return f"Variáveis ausentes: {', '.join(faltando)}"
+    for v in exigidas:
+        valor = fazenda[v]
+        if valor is not None and not isinstance(valor, (int, float)):
+            return f"'{v}' deve ser numérico ou null"
+    return None
+
+
+def pontuar_lote(fazendas):
+    """
+    Calcula os quatro índices de uma lista de fazendas (dicts já validados) com Fuzzy.pontuar_fazendas.
+    Roda nos processos do pool
+    """
+    n = len(fazendas)
+    colunas = {v: np.full(n, np.nan) for v in ENTRADAS}
+    for i, fazenda in enumerate(fazendas):
+        for v in ENTRADAS:
+            valor = fazenda.get(v)
+            if valor is not None:
+                colunas[v][i] = float(valor)
+
+    cadastro = [i for i, f in enumerate(fazendas) if 'estado' in f and not all(v in f for v in AMBIENTAIS)]
+    if cadastro:
+        dados = [[fazendas[i][c] for i in cadastro] for c in CAMPOS_FAZENDA]
+        dados[1:] = [np.array([np.nan if x is None else x for x in d], dtype=float) for d in dados[1:]]
+        derivadas = Fuzzy.variaveis_ambientais(np.array([str(e) for e in dados[0]]), *dados[1:])
+        for v in AMBIENTAIS:
+            colunas[v][cadastro] = derivadas[v]
+
+    indices = Fuzzy.pontuar_fazendas(colunas, pertinencias=False)['indices']
+    return [{nome: (None if math.isnan(x) else x) for nome, x in zip(INDICES, valores)}
+            for valores in zip(*[indices[nome].tolist() for nome in INDICES])]
+
+
+def _aquecer():
+    pontuar_lote([{v: 0.5 for v in ENTRADAS}])
+
+
+class Agrupador:
+    """
+    Junta as fazendas recebidas numa janela de `janela` segundos (ou até lote_maximo) e manda o lote
+    para o executor. Vários lotes podem estar em cálculo ao mesmo tempo
+    """
+
+    def __init__(self, executor, janela=0.005, lote_maximo=1024):
+        self.executor = executor
+        self.janela = janela
+        self.lote_maximo = lote_maximo
+        self.pendentes = []
+        self._disparo = None
+        self.requisicoes = self.lotes = self.em_calculo = 0
+
+    async def pontuar(self, fazenda):
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self.pendentes.append((fazenda, futuro))
+        self.requisicoes += 1
+        if len(self.pendentes) >= self.lote_maximo:
+            self._enviar()
+        elif self._disparo is None:
+            self._disparo = loop.call_later(self.janela, self._enviar)
+        return await futuro
+
+    def _enviar(self):
+        if self._disparo is not None:
+            self._disparo.cancel()
+            self._disparo = None
+        lote, self.pendentes = self.pendentes, []
+        if not lote:
+            return
+        self.lotes += 1
+        self.em_calculo += 1
+        calculo = asyncio.get_running_loop().run_in_executor(self.executor, pontuar_lote, [f for f, _ in lote])
+        calculo.add_done_callback(lambda c: self._distribuir(c, [futuro for _, futuro in lote]))
+
+    def _distribuir(self, calculo, futuros):
+        self.em_calculo -= 1
+        erro = calculo.exception()
+        for i, futuro in enumerate(futuros):
+            if futuro.done():
+                continue
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(calculo.result()[i])
+
+    def estatisticas(self):
+        return {'modelo': Fuzzy.modelo_atual().identificador, 'requisicoes': self.requisicoes, 'lotes': self.lotes, 'em_calculo': self.em_calculo,
+                'lote_medio': self.requisicoes / self.lotes if self.lotes else 0.0,
+                'janela_ms': self.janela * 1e3, 'lote_maximo': self.lote_maximo}
+
+
+MOTIVOS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+async def _responder(escritor, status, corpo=None, manter=True):
+    dados = b'' if corpo is None else json.dumps(corpo).encode()
+    cabecalho = [f'HTTP/1.1 {status} {MOTIVOS[status]}',
+                 'Content-Type: application/json',
+                 f'Content-Length: {len(dados)}',
+                 'Access-Control-Allow-Origin: *',
+                 'Access-Control-Allow-Methods: GET, POST, OPTIONS',
+                 'Access-Control-Allow-Headers: Content-Type',
+                 f"Connection: {'keep-alive' if manter else 'close'}"]
+    escritor.write(('\r\n'.join(cabecalho) + '\r\n\r\n').encode() + dados)
+    await escritor.drain()
+
+
+async def _atender(agrupador, leitor, escritor):
+    """
+    Atende uma conexão HTTP/1.1 (com keep-alive) até o cliente fechar
+    """
+    try:
+        while True:
+            linha = await leitor.readline()
+            if not linha:
+                break
+            try:
+                metodo, caminho, versao = linha.decode('latin-1').split()
+            except ValueError:
+                await _responder(escritor, 400, {'erro': 'Requisição malformada'}, manter=False)
+                break
+            cabecalhos = {}
+            while True:
+                linha = await leitor.readline()
+                if linha in (b'\r\n', b'\n', b''):
+                    break
+                nome, _, valor = linha.decode('latin-1').partition(':')
+                cabecalhos[nome.strip().lower()] = valor.strip()
+            tamanho = cabecalhos.get('content-length') or '0'
+            if not (tamanho.isascii() and tamanho.isdigit()):
+                # Sem um tamanho válido não dá para saber onde o corpo termina: fecha a conexão
+                await _responder(escritor, 400, {'erro': 'Content-Length inválido'}, manter=False)
+                break
+            tamanho = int(tamanho)
+            if tamanho > TAMANHO_MAXIMO_CORPO:
+                await _responder(escritor, 413, {'erro': 'Corpo grande demais'}, manter=False)
+                break
+            corpo = await leitor.readexactly(tamanho) if tamanho else b''
+            manter = cabecalhos.get('connection', '').lower() != 'close' and versao == 'HTTP/1.1'
+
+            caminho = caminho.split('?', 1)[0]
+            if metodo == 'OPTIONS':
+                await _responder(escritor, 204, manter=manter)
+            elif caminho == '/estatisticas':
+                await _responder(escritor, 200, agrupador.estatisticas(), manter)
+            elif caminho != '/indices':
+                await _responder(escritor, 404, {'erro': f'Caminho desconhecido: {caminho}'}, manter)
+            elif metodo != 'POST':
+                await _responder(escritor, 405, {'erro': 'Use POST'}, manter)
+            else:
+                try:
+                    fazenda = json.loads(corpo or b'null')
+                except ValueError:
+                    fazenda = None
+                erro = validar_fazenda(fazenda)
+                if erro:
+                    await _responder(escritor, 400, {'erro': erro}, manter)
+                else:
+                    try:
+                        await _responder(escritor, 200, await agrupador.pontuar(fazenda), manter)
+                    except Exception as e:
+                        await _responder(escritor, 500, {'erro': str(e)}, manter)
+            if not manter:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+        # Cliente desconectou ou o serviço está sendo encerrado
+        pass
+    finally:
+        escritor.close()
+
+
+async def iniciar(host='127.0.0.1', porta=8080, janela=0.005, lote_maximo=1024, executor=None):
+    """
+    Sobe o serviço no laço de eventos atual. Retorna (asyncio.Server, Agrupador)
+    """
+    if executor is None:
+        executor = ProcessPoolExecutor(os.cpu_count() or 1, initializer=_aquecer)
+    agrupador = Agrupador(executor, janela, lote_maximo)
+    servidor = await asyncio.start_server(lambda l, e: _atender(agrupador, l, e), host, porta)
+    return servidor, agrupador
+
+
+def _executor(processos, threads):
+    if threads:
+        return ThreadPoolExecutor(threads, initializer=_aquecer)
+    return ProcessPoolExecutor(processos or os.cpu_count() or 1, initializer=_aquecer)
+
+
+async def _servir(args):
+    servidor, _ = await iniciar(args.host, args.porta, args.janela_ms / 1e3, args.lote_maximo,
+                                _executor(args.processos, args.threads))
+    host, porta = servidor.sockets[0].getsockname()[:2]
+    print(f"Servindo em http://{host}:{porta} (POST /indices, GET /estatisticas)", file=sys.stderr)
+    async with servidor:
+        await servidor.serve_forever()
+
+
+async def _requisitar(leitor, escritor, host, metodo, caminho, corpo=b''):
+    escritor.write((f'{metodo} {caminho} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                    f'Content-Length: {len(corpo)}\r\n\r\n').encode() + corpo)
+    await escritor.drain()
+    status = int((await leitor.readline()).split()[1])
+    tamanho = 0
+    while True:
+        linha = await leitor.readline()
+        if linha in (b'\r\n', b''):
+            break
+        nome, _, valor = linha.decode('latin-1').partition(':')
+        if nome.strip().lower() == 'content-length':
+            tamanho = int(valor)
+    return status, json.loads(await leitor.readexactly(tamanho)) if tamanho else None
+
+
+def _fazendas_sinteticas(n, semente=0):
+    import benchmark
+    dados = benchmark.gerar_fazendas(n, semente)
+    return [{v: dados[v][i].item() for v in ENTRADAS} for i in range(n)]
+
+
+async def gerar_carga(url, requisicoes, concorrencia, semente=0):
+    """
+    `concorrencia` clientes com conexão keep-alive enviam `requisicoes` fazendas sintéticas ao todo.
+    Retorna latência, vazão, estatísticas do serviço e divergências em relação ao cálculo em lote
+    """
+    partes = urlsplit(url)
+    host, porta = partes.hostname, partes.port or 80
+    fazendas = _fazendas_sinteticas(requisicoes, semente)
+    respostas = [None] * requisicoes
+    latencias = []
+    erros = 0
+    proxima = iter(range(requisicoes))
+
+    async def cliente():
+        nonlocal erros
+        leitor, escritor = await asyncio.open_connection(host, porta)
+        try:
+            for i in proxima:
+                corpo = json.dumps(fazendas[i]).encode()
+                inicio = time.perf_counter()
+                status, resposta = await _requisitar(leitor, escritor, host, 'POST', '/indices', corpo)
+                latencias.append(time.perf_counter() - inicio)
+                if status == 200:
+                    respostas[i] = resposta
+                else:
+                    erros += 1
+        finally:
+            escritor.close()
+            await escritor.wait_closed()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*[cliente() for _ in range(concorrencia)])
+    duracao = time.perf_counter() - inicio
+
+    leitor, escritor = await asyncio.open_connection(host, porta)
+    _, estatisticas = await _requisitar(leitor, escritor, host, 'GET', '/estatisticas')
+    escritor.close()
+    await escritor.wait_closed()
+
+    esperado = pontuar_lote(fazendas)
+    divergencias = sum(1 for r, e in zip(respostas, esperado) if r is not None and any(
+        (r[k] is None) != (e[k] is None) or (e[k] is not None and abs(r[k] - e[k]) > 1e-9) for k in INDICES))
+    ms = np.array(latencias) * 1e3
+    return {
+        'requisicoes': requisicoes,
+        'concorrencia': concorrencia,
+        'duracao_s': duracao,
+        'requisicoes_por_s': requisicoes / duracao,
+        'latencia_ms': {'p50': float(np.percentile(ms, 50)), 'p95': float(np.percentile(ms, 95)),
+                        'p99': float(np.percentile(ms, 99)), 'maxima': float(ms.max())},
+        'erros': erros,
+        'divergencias': divergencias,
+        'servico': estatisticas,
+    }
+
+
+async def _carga(args):
+    if args.url:
+        return await gerar_carga(args.url, args.requisicoes, args.concorrencia)
+    executor = _executor(args.processos, args.threads)
+    servidor, _ = await iniciar('127.0.0.1', 0, args.janela_ms / 1e3, args.lote_maximo, executor)
+    try:
+        async with servidor:
+            porta = servidor.sockets[0].getsockname()[1]
+            return await gerar_carga(f'http://127.0.0.1:{porta}', args.requisicoes, args.concorrencia)
+    finally:
+        executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='comando', required=True)
+    servir = sub.add_parser('servir', help='sobe o serviço HTTP')
+    servir.add_argument('--host', default='127.0.0.1')
+    servir.add_argument('--porta', type=int, default=8080)
+    carga = sub.add_parser('carga', help='gerador de carga local; sem --url sobe o serviço no mesmo processo')
+    carga.add_argument('--url', help='serviço já em execução (ex. http://127.0.0.1:8080)')
+    carga.add_argument('--requisicoes', type=int, default=5000)
+    carga.add_argument('--concorrencia', type=int, default=64)
+    for sub_parser in (servir, carga):
+        sub_parser.add_argument('--janela-ms', type=float, default=5.0, help='janela de agrupamento (padrão: 5 ms)')
+        sub_parser.add_argument('--lote-maximo', type=int, default=1024, help='fazendas por lote (padrão: 1024)')
+        sub_parser.add_argument('--processos', type=int, default=None, help='processos no pool (padrão: núcleos)')
+        sub_parser.add_argument('--threads', type=int, default=None, help='usa um pool de threads no lugar de processos')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'servir':
+        try:
+            asyncio.run(_servir(args))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    resultado = asyncio.run(_carga(args))
+    print(json.dumps(resultado, indent=2))
+    return 1 if resultado['erros'] or resultado['divergencias'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,430 @@
+"""
+Testes do motor compilado (contra o skfuzzy e entre as funções escalares e em lote) e das demais
+funcionalidades do Fuzzy.py, do servico.py e do reprocessar.py. Rodar a partir de fuzzy/:
+
+    python -m pytest -q
+"""
+import asyncio
+import gc
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import Fuzzy
+import motor
+import reprocessar
+import servico
+
+
+def _fazendas(n, semente=0):
+    """
+    n fazendas aleatórias dentro dos universos de cada variável, com plano_saude e compartilha_lucros 0/1
+    """
+    rng = np.random.default_rng(semente)
+    universos = {rotulo: arange for modelo in Fuzzy.SISTEMAS.values()
+                 for rotulo, (arange, _) in modelo['antecedentes'].items()}
+    fazendas = {r: rng.uniform(universos[r][0], universos[r][1], n) for r in Fuzzy.ENTRADAS}
+    for rotulo in ('plano_saude', 'compartilha_lucros'):
+        fazendas[rotulo] = rng.integers(0, 2, n).astype(float)
+    return fazendas
+
+
+def _lotes_encadeados(f):
+    economico = Fuzzy.calcular_indice_economico_lote(f['DL'], f['FV'], f['P'], f['WI'])
+    social = Fuzzy.calcular_indice_social_lote(f['Anos_de_estudo'], f['plano_saude'], f['compartilha_lucros'],
+                                               f['JA'], f['TC'], f['JQ'])
+    ambiental = Fuzzy.calcular_indice_ambiental_lote(f['Escoamento'], f['FO'], f['consumo_area'])
+    return {'economico': economico, 'social': social, 'ambiental': ambiental,
+            'sustentabilidade': Fuzzy.calcular_sustentabilidade_lote(economico, social, ambiental)}
+
+
+def test_equivalencia_com_skfuzzy():
+    diferencas = Fuzzy.verificar_equivalencia(n=100)
+    assert max(diferencas.values()) < 1e-9, diferencas
+
+
+def test_escalar_igual_ao_lote():
+    f = _fazendas(20)
+    lote = _lotes_encadeados(f)
+    for i in range(20):
+        assert Fuzzy.calcular_indice_economico(f['DL'][i], f['FV'][i], f['P'][i], f['WI'][i]) == \
+            pytest.approx(lote['economico'][i], abs=1e-9)
+        assert Fuzzy.calcular_indice_social(f['Anos_de_estudo'][i], f['plano_saude'][i], f['compartilha_lucros'][i],
+                                            f['JA'][i], f['TC'][i], f['JQ'][i]) == \
+            pytest.approx(lote['social'][i], abs=1e-9)
+        assert Fuzzy.calcular_indice_ambiental(f['Escoamento'][i], f['FO'][i], f['consumo_area'][i]) == \
+            pytest.approx(lote['ambiental'][i], abs=1e-9)
+
+
+def test_tabela_lut_construida_reaproveitada_e_refeita(tmp_path):
+    modelo = motor.carregar_modelo(Fuzzy.CAMINHO_MODELO)
+    tabela = motor.TabelaConsulta(modelo.compilado('sustentabilidade'), resolucao=11, diretorio=str(tmp_path),
+                                  pontos_verificacao=500, limites=modelo.limites('sustentabilidade'))
+    arquivos = sorted(p.name for p in tmp_path.iterdir())
+    assert len(arquivos) == 2
+    limites = modelo.limites('sustentabilidade')
+    assert tabela.erro_maximo_indice == pytest.approx(tabela.erro_maximo * 100 / (limites[1] - limites[0]))
+
+    # Mesma assinatura: a tabela gravada é reaproveitada, sem recalcular
+    construir = motor.TabelaConsulta._construir
+    motor.TabelaConsulta._construir = None
+    try:
+        reaproveitada = motor.TabelaConsulta(modelo.compilado('sustentabilidade'), resolucao=11,
+                                             diretorio=str(tmp_path))
+    finally:
+        motor.TabelaConsulta._construir = construir
+    assert reaproveitada.erro_maximo == tabela.erro_maximo
+    np.testing.assert_array_equal(reaproveitada.tabela, tabela.tabela)
+
+    # Regras alteradas: nova assinatura, nova tabela
+    modelo.sistemas['sustentabilidade']['regras'].pop()
+    refeita = motor.TabelaConsulta(modelo.compilado('sustentabilidade'), resolucao=11, diretorio=str(tmp_path),
+                                   pontos_verificacao=500)
+    assert refeita.assinatura() != tabela.assinatura()
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test_tabela_lut_sem_diretorio_gravavel(tmp_path):
+    arquivo = tmp_path / 'arquivo'
+    arquivo.write_text('')
+    compilado = motor.carregar_modelo(Fuzzy.CAMINHO_MODELO).compilado('sustentabilidade')
+    tabela = motor.TabelaConsulta(compilado, resolucao=11, diretorio=str(arquivo / 'lut'), pontos_verificacao=500)
+    entradas = {r: np.array([50.0]) for r in compilado.variaveis}
+    assert abs(tabela.avaliar(entradas)[0] - compilado.avaliar(entradas)[0]) <= tabela.erro_maximo
+
+
+def test_modo_lut_dentro_do_erro_medido(tmp_path):
+    tabela = Fuzzy.ativar_modo_lut(resolucao=21, diretorio=str(tmp_path))
+    try:
+        pontos = [(75.5, 62.3, 88.1), (10, 50, 90), (33.3, 33.3, 33.3)]
+        lut = [Fuzzy.calcular_sustentabilidade(*p) for p in pontos]
+    finally:
+        Fuzzy.desativar_modo_lut()
+    for ponto, valor in zip(pontos, lut):
+        assert abs(valor - Fuzzy.calcular_sustentabilidade(*ponto)) <= tabela.erro_maximo_indice + 1e-9
+
+
+def test_funcoes_escalares_concorrentes_iguais_ao_lote():
+    f = _fazendas(400, semente=2)
+    esperado = _lotes_encadeados(f)['social']
+
+    def calcular(posicoes):
+        return [Fuzzy.calcular_indice_social(f['Anos_de_estudo'][i], f['plano_saude'][i], f['compartilha_lucros'][i],
+                                             f['JA'][i], f['TC'][i], f['JQ'][i]) for i in posicoes]
+
+    fatias = np.array_split(np.random.default_rng(0).permutation(400), 8)
+    obtido = np.empty(400)
+    with ThreadPoolExecutor(8) as executor:
+        for posicoes, resultados in zip(fatias, executor.map(calcular, fatias)):
+            obtido[posicoes] = resultados
+    np.testing.assert_allclose(obtido, esperado, rtol=0, atol=1e-9)
+
+
+def test_simuladores_por_thread_concorrentes_e_descartados():
+    f = _fazendas(24, semente=3)
+    rotulos = ['Anos_de_estudo', 'plano_saude', 'compartilha_lucros', 'JA', 'TC', 'JQ']
+    esperado = Fuzzy._compilado('social').avaliar({r: f[r] for r in rotulos})
+
+    def calcular(posicoes):
+        simulador = Fuzzy.simulador_da_thread(Fuzzy.sistema_social)
+        saida = []
+        for i in posicoes:
+            for rotulo in rotulos:
+                simulador.input[rotulo] = f[rotulo][i]
+            simulador.compute()
+            saida.append(simulador.output['indice_social'])
+        return saida
+
+    fatias = np.array_split(np.arange(24), 4)
+    with ThreadPoolExecutor(4) as executor:
+        obtido = np.concatenate([np.asarray(r) for r in executor.map(calcular, fatias)])
+    np.testing.assert_allclose(obtido, esperado, rtol=0, atol=1e-9)
+
+    # Recarregar os sistemas descarta os simuladores da thread em vez de acumulá-los
+    for _ in range(5):
+        Fuzzy.simulador_da_thread(Fuzzy.sistema_social)
+        Fuzzy.recarregar_sistemas()
+    Fuzzy.simulador_da_thread(Fuzzy.sistema_social)
+    gc.collect()
+    assert len(Fuzzy._simuladores_thread.simuladores) == 1
+
+    # Um sistema que deixou de existir leva junto o seu simulador (não fica preso a um id reaproveitado)
+    sistema = motor.construir_skfuzzy(Fuzzy.SISTEMAS['social'])
+    Fuzzy.simulador_da_thread(sistema)
+    del sistema
+    gc.collect()
+    assert len(Fuzzy._simuladores_thread.simuladores) == 1
+
+
+def test_reprocessar_retoma_depois_de_gravacao_parcial(tmp_path):
+    import pandas as pd
+
+    f = _fazendas(45, semente=4)
+    entrada = pd.DataFrame({coluna: f[variavel] for coluna, variavel in reprocessar.COLUNAS.items()})
+    for coluna in reprocessar.BOOLEANAS:
+        entrada[coluna] = np.where(entrada[coluna] > 0, 'true', 'false')
+    entrada.insert(0, 'id', range(45))
+    caminho_entrada = str(tmp_path / 'parametros.csv')
+    entrada.to_csv(caminho_entrada, index=False)
+
+    completo = str(tmp_path / 'completo.csv')
+    reprocessar.reprocessar(caminho_entrada, completo, tamanho_bloco=10, processos=1, relatorio=io.StringIO())
+
+    # Interrompe depois de 2 blocos confirmados, com parte de um 3º bloco já escrita no CSV
+    parcial = str(tmp_path / 'parcial.csv')
+    gravar = reprocessar.Saida.gravar
+
+    def gravar_e_interromper(saida, resultado):
+        if saida.progresso['blocos'] == 2:
+            with open(saida.caminho, 'a') as arquivo:
+                arquivo.write('20,12.5,')
+            raise KeyboardInterrupt
+        gravar(saida, resultado)
+
+    reprocessar.Saida.gravar = gravar_e_interromper
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            reprocessar.reprocessar(caminho_entrada, parcial, tamanho_bloco=10, processos=1, relatorio=io.StringIO())
+    finally:
+        reprocessar.Saida.gravar = gravar
+    with open(parcial + '.progresso.json') as arquivo:
+        assert json.load(arquivo)['linhas'] == 20
+
+    total = reprocessar.reprocessar(caminho_entrada, parcial, tamanho_bloco=10, processos=1, retomar=True,
+                                    relatorio=io.StringIO())
+    assert total == 45
+    with open(completo) as a, open(parcial) as b:
+        assert a.read() == b.read()
+
+    # Não retoma com outro modelo
+    with open(parcial + '.progresso.json') as arquivo:
+        progresso = json.load(arquivo)
+    progresso['modelo'] = 'outro+000000000000'
+    with open(parcial + '.progresso.json', 'w') as arquivo:
+        json.dump(progresso, arquivo)
+    with pytest.raises(ValueError, match='modelo'):
+        reprocessar.reprocessar(caminho_entrada, parcial, retomar=True, relatorio=io.StringIO())
+
+
+def test_cache_acertos_descartes_invalidacao_e_quantizacao():
+    Fuzzy.ativar_cache(tamanho=2, quantizacao={'P': 10}, sistemas=['economico'])
+    try:
+        exato = [Fuzzy.calcular_indice_economico(0.3, 20, p, 4) for p in (3000, 3500, 4000)]
+        assert Fuzzy.calcular_indice_economico(0.3, 20, 4000, 4) == exato[2]    # acerto
+        assert Fuzzy.calcular_indice_economico(0.3, 20, 3000, 4) == exato[0]    # falha: 3000 foi descartado
+        assert Fuzzy.estatisticas_cache()['economico'] == {
+            'acertos': 1, 'falhas': 4, 'descartes': 2, 'invalidacoes': 0, 'itens': 2, 'tamanho': 2}
+
+        # Quantização: 3996 e 4004 caem no degrau 4000 e reaproveitam o resultado dele
+        assert Fuzzy.calcular_indice_economico(0.3, 20, 3996, 4) == exato[2]
+        assert Fuzzy.calcular_indice_economico(0.3, 20, 4004, 4) == exato[2]
+        assert Fuzzy.estatisticas_cache()['economico']['acertos'] == 3
+
+        # Regras alteradas + recarregar_sistemas: os resultados antigos são descartados
+        regra = Fuzzy.SISTEMAS['economico']['regras'].pop()
+        try:
+            Fuzzy.recarregar_sistemas()
+            Fuzzy.calcular_indice_economico(0.3, 20, 4000, 4)
+            estatisticas = Fuzzy.estatisticas_cache()['economico']
+        finally:
+            Fuzzy.SISTEMAS['economico']['regras'].append(regra)
+            Fuzzy.recarregar_sistemas()
+        assert estatisticas['invalidacoes'] == 1
+        assert estatisticas['itens'] == 1
+        assert estatisticas['acertos'] == 3
+    finally:
+        Fuzzy.desativar_cache()
+    assert Fuzzy.estatisticas_cache() == {}
+
+
+def test_ambiental_das_fazendas_igual_ao_lote():
+    rng = np.random.default_rng(5)
+    ufs = np.array(sorted(Fuzzy.Regulamentação) + ['XX', ' sp '])
+    estado = rng.choice(ufs, 300)
+    area_total = rng.uniform(1, 1000, 300)
+    area_total[:10] = 0
+    area_produtiva = area_total * rng.uniform(0, 1, 300)
+    consumo = rng.uniform(0, 40, 300) * area_total
+
+    obtido = Fuzzy.calcular_indice_ambiental_fazendas(estado, area_total, area_produtiva, consumo)
+    variaveis = Fuzzy.variaveis_ambientais(estado, area_total, area_produtiva, consumo)
+    esperado = Fuzzy.calcular_indice_ambiental_lote(variaveis['Escoamento'], variaveis['FO'], variaveis['consumo_area'])
+    np.testing.assert_allclose(obtido, esperado, rtol=0, atol=1e-9)
+
+    # Estado desconhecido e área total 0: NaN no lote, None (com erro registrado) na função escalar
+    invalidas = (estado == 'XX') | (area_total == 0)
+    assert invalidas.any() and np.isnan(obtido[invalidas]).all() and not np.isnan(obtido[~invalidas]).any()
+    for i in [*np.flatnonzero(invalidas)[:3], *np.flatnonzero(~invalidas)[:3]]:
+        escalar = Fuzzy.calcular_indice_ambiental_fazenda(estado[i], area_total[i], area_produtiva[i], consumo[i])
+        assert escalar is None if invalidas[i] else escalar == pytest.approx(obtido[i], abs=1e-9)
+
+
+def test_limites_gravados_iguais_aos_calculados():
+    modelo = motor.carregar_modelo(Fuzzy.CAMINHO_MODELO)
+    for nome, sistema in modelo.sistemas.items():
+        calculados = modelo.compilado(nome).limites(sistema.get('dominio'))
+        assert tuple(sistema['limites']) == pytest.approx(calculados, abs=1e-9)
+    # No domínio válido (plano de saúde e participação nos lucros 0 ou 1) o menor índice social é 20.83
+    assert modelo.sistemas['social']['limites'][0] == pytest.approx(20.8307, abs=1e-4)
+
+
+def test_motor_analitico_e_resolucao_contra_referencia_fina():
+    modelo = motor.carregar_modelo(Fuzzy.CAMINHO_MODELO)
+    rng = np.random.default_rng(6)
+    for nome, sistema in modelo.sistemas.items():
+        entradas = {r: rng.uniform(arange[0], arange[1], 200) for r, (arange, _) in sistema['antecedentes'].items()}
+        referencia = modelo.compilado(nome, 'amostrada', 20001).avaliar(entradas)
+        np.testing.assert_allclose(modelo.compilado(nome, 'analitica').avaliar(entradas), referencia, atol=1e-5)
+        np.testing.assert_allclose(modelo.compilado(nome, 'amostrada', 2001).avaliar(entradas), referencia, atol=5e-3)
+
+
+def test_configurar_motor_analitico():
+    f = _fazendas(50, semente=7)
+    Fuzzy.configurar_motor('analitica')
+    try:
+        limites = Fuzzy._limites('social')
+        assert Fuzzy._limites('social') is limites
+        lote = _lotes_encadeados(f)
+        escalar = [Fuzzy.calcular_indice_social(f['Anos_de_estudo'][i], f['plano_saude'][i],
+                                                f['compartilha_lucros'][i], f['JA'][i], f['TC'][i], f['JQ'][i])
+                   for i in range(50)]
+    finally:
+        Fuzzy.configurar_motor()
+    np.testing.assert_allclose(escalar, lote['social'], atol=1e-9)
+    assert all(0 <= v <= 100 + 1e-9 for nome in Fuzzy.INDICES for v in lote[nome])
+    assert limites != Fuzzy._limites('social')
+
+
+async def _requisicao(porta, requisicao):
+    leitor, escritor = await asyncio.open_connection('127.0.0.1', porta)
+    escritor.write(requisicao)
+    await escritor.drain()
+    status = int((await leitor.readline()).split()[1])
+    while (await leitor.readline()) not in (b'\r\n', b''):
+        pass
+    corpo = await leitor.read()
+    escritor.close()
+    return status, json.loads(corpo) if corpo else None
+
+
+def _post(fazenda):
+    corpo = json.dumps(fazenda).encode()
+    return (f'POST /indices HTTP/1.1\r\nContent-Length: {len(corpo)}\r\nConnection: close\r\n\r\n'
+            .encode() + corpo)
+
+
+def test_servico():
+    fazenda = {'Anos_de_estudo': 10, 'plano_saude': 1, 'compartilha_lucros': 0, 'JA': 0.5, 'TC': 5, 'JQ': 6,
+               'DL': 0.3, 'FV': 20, 'P': 3000, 'WI': 4, 'Escoamento': 0.2, 'FO': 0.5, 'consumo_area': 3}
+    cadastro = {v: fazenda[v] for v in fazenda if v not in servico.AMBIENTAIS}
+    cadastro.update(estado='SP', area_total=100, area_produtiva=80, consumo_combustivel=5000)
+
+    async def executar():
+        servidor, _ = await servico.iniciar('127.0.0.1', 0, executor=ThreadPoolExecutor(1))
+        porta = servidor.sockets[0].getsockname()[1]
+        try:
+            respostas = [await _requisicao(porta, _post(fazenda)), await _requisicao(porta, _post(cadastro)),
+                         await _requisicao(porta, _post({**cadastro, 'FO': 0.5}))]
+            for valor in ('abc', '-5'):
+                respostas.append(await _requisicao(
+                    porta, f'POST /indices HTTP/1.1\r\nContent-Length: {valor}\r\n\r\n'.encode()))
+            return respostas
+        finally:
+            servidor.close()
+            await servidor.wait_closed()
+
+    (status, indices), (status_cadastro, indices_cadastro), (status_misto, erro), *invalidos = asyncio.run(executar())
+    assert status == 200
+    esperado = Fuzzy.pontuar_fazenda(**fazenda)['indices']
+    assert indices == {nome: pytest.approx(v, abs=1e-9) for nome, v in esperado.items()}
+    assert status_cadastro == 200
+    assert indices_cadastro['ambiental'] == pytest.approx(Fuzzy.calcular_indice_ambiental_fazenda('SP', 100, 80, 5000))
+    # Só parte das variáveis ambientais junto com o cadastro: recusado em vez de descartar FO
+    assert status_misto == 400 and 'FO' in erro['erro']
+    assert [s for s, _ in invalidos] == [400, 400]
+
+
+def test_instrumentacao_conta_cada_chamada_uma_vez():
+    instrumentacao = Fuzzy.ativar_instrumentacao()
+    try:
+        assert Fuzzy.calcular_indice_ambiental_fazenda('SP', 100, 80, 5000) is not None
+        assert Fuzzy.calcular_indice_ambiental_fazenda('XX', 100, 80, 5000) is None
+        resumo = instrumentacao.resumo()
+    finally:
+        Fuzzy.desativar_instrumentacao()
+    assert set(resumo) == {'ambiental_fazenda'}
+    assert resumo['ambiental_fazenda']['chamadas'] == 2
+    assert resumo['ambiental_fazenda']['erros'] == {'ValueError': 1}
+    assert set(resumo['ambiental_fazenda']['etapas_s']) == {'entradas', 'fuzzificacao', 'regras', 'defuzzificacao'}
+
+
+def test_entrada_ausente_vira_evento_com_a_variavel():
+    eventos = []
+    Fuzzy.ativar_instrumentacao(callback=eventos.append)
+    try:
+        assert Fuzzy.calcular_indice_social(None, 1, 0, 0.5, 5, 6) is None
+        assert Fuzzy.calcular_indice_economico(0.3, float('nan'), 3000, 4) is None
+        assert Fuzzy.calcular_sustentabilidade(50, None, 50) is None
+        assert Fuzzy.calcular_sustentabilidade(50, 120, 50) is None
+    finally:
+        Fuzzy.desativar_instrumentacao()
+    erros = [e for e in eventos if e['tipo'] == 'erro']
+    assert [e['erro'] for e in erros] == ['EntradaInvalida', 'EntradaInvalida', 'EntradaInvalida', 'ValueError']
+    assert ["'Anos_de_estudo'" in erros[0]['mensagem'], "'FV'" in erros[1]['mensagem'],
+            "'social'" in erros[2]['mensagem']] == [True, True, True]
+
+
+def test_cenarios_iguais_ao_lote():
+    fazenda = {'Anos_de_estudo': 9, 'plano_saude': 0, 'compartilha_lucros': 0, 'JA': 0.6, 'TC': 4, 'JQ': 5}
+    anos = np.arange(0, 21)
+    resultado = Fuzzy.analisar_cenarios('social', fazenda, grade={'Anos_de_estudo': anos, 'plano_saude': [0, 1]})
+    for j, plano in enumerate([0, 1]):
+        lote = Fuzzy.calcular_indice_social_lote(anos, np.full(21, plano), np.zeros(21), np.full(21, 0.6),
+                                                 np.full(21, 4), np.full(21, 5))
+        np.testing.assert_allclose(resultado['indices'][:, j], lote, atol=1e-9)
+    assert resultado['base'] == pytest.approx(Fuzzy.calcular_indice_social(9, 0, 0, 0.6, 4, 5), abs=1e-9)
+
+    variacoes = Fuzzy.analisar_cenarios('social', fazenda, variacoes=[{'plano_saude': 1}, {'TC': 7}])
+    assert variacoes['indices'][0] == pytest.approx(Fuzzy.calcular_indice_social(9, 1, 0, 0.6, 4, 5), abs=1e-9)
+    assert variacoes['indices'][1] == pytest.approx(Fuzzy.calcular_indice_social(9, 0, 0, 0.6, 7, 5), abs=1e-9)
+
+
+def test_modelo_copia_e_hash(tmp_path):
+    original = motor.carregar_modelo(Fuzzy.CAMINHO_MODELO)
+    alterado = motor.carregar_modelo(Fuzzy.CAMINHO_MODELO)
+    compilado = alterado.compilado('social')
+    assert alterado.compilado('social') is compilado
+    alterado.sistemas['social']['regras'].pop()
+    assert alterado.compilado('social') is not compilado
+    assert alterado.identificador != original.identificador
+    assert motor.carregar_modelo(Fuzzy.CAMINHO_MODELO).identificador == original.identificador
+
+    caminho = str(tmp_path / 'modelo.json')
+    alterado.salvar(caminho, limites=False)
+    relido = motor.carregar_modelo(caminho)
+    assert relido.hash == alterado.hash
+    assert 'limites' not in relido.sistemas['social']
+
+    with open(caminho, encoding='utf-8') as arquivo:
+        dados = json.load(arquivo)
+    dados['sistemas']['social']['regras'].pop()
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(dados, arquivo)
+    with pytest.raises(ValueError, match='hash'):
+        motor.carregar_modelo(caminho)
+
+
+def test_encadeamento_igual_aos_lotes():
+    f = _fazendas(500, semente=1)
+    lote = _lotes_encadeados(f)
+    resultado = Fuzzy.pontuar_fazendas(f, tamanho_bloco=128)
+    for nome in Fuzzy.INDICES:
+        np.testing.assert_array_equal(resultado['indices'][nome], lote[nome])
+    graus = resultado['pertinencias']['plano_saude']
+    assert all(len(g) == 500 for g in graus.values())
+
+    unica = Fuzzy.pontuar_fazenda(**{r: v[0] for r, v in f.items()})
+    assert unica['indices'] == {nome: pytest.approx(lote[nome][0], abs=1e-9) for nome in Fuzzy.INDICES}
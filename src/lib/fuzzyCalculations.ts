@@ -5,7 +5,7 @@
 //   - mesmas regras
 //   - agregação por max, implicação por min (Mamdani)
 //   - defuzzificação por centroide sobre o universo 0..100
-//   - mesma normalização final por eixo (constantes do Python)
+//   - mesma normalização final por eixo (limites calculados pelo Fuzzy.py, NORMALIZACAO_*)
 // ================================================
 
 import { supabase } from '@/lib/supabase';
@@ -240,7 +240,7 @@ export function calcularIndiceSocial(formData: FormData): number {
     fire(out, 'a', ps.sim); fire(out, 'b', ps.nao);
 
     const raw = defuzzCentroid(out);
-    return clamp((raw - 20.83066751972702) * 100 / (80.55555555555556 - 20.83066751972702), 0, 100);
+    return clamp((raw - 20.830667519727026) * 100 / (80.55555555555554 - 20.830667519727026), 0, 100);
   } catch (error) {
     console.error('Erro ao calcular índice social:', error);
     return 0;
@@ -307,7 +307,7 @@ export function calcularIndiceAmbiental(formData: FormData): number {
     fire(out, 'mb', co.ma);
 
     const raw = defuzzCentroid(out);
-    return clamp((raw - 20.83066751972702) * 100 / (80.55555555555556 - 20.83066751972702), 0, 100);
+    return clamp((raw - 13.855254431046324) * 100 / (80.55555555555556 - 13.855254431046324), 0, 100);
   } catch (error) {
     console.error('Erro ao calcular índice ambiental:', error);
     return 0;
@@ -341,7 +341,7 @@ export function calcularIndiceSustentabilidade(economico: number, social: number
     ));
 
     const raw = defuzzCentroid(out);
-    return clamp((raw - 8.33) * 100 / (80.56 - 8.33), 0, 100);
+    return clamp((raw - 8.333333333333332) * 100 / (80.55555555555554 - 8.333333333333332), 0, 100);
   } catch (error) {
     console.error('Erro ao calcular índice de sustentabilidade:', error);
     return 0;